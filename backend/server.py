@@ -1,20 +1,49 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Response, UploadFile
+from fastapi import File as UploadField
 from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel, InsertOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 from bson import ObjectId
 import json
+import re
+import ast
+import math
+import itertools
 import asyncio
+import time
+import shutil
+import signal
+import tempfile
+import codecs
+import hashlib
+import base64
+import posixpath
+import io
+import tarfile
+import zipfile
+import zlib
+import random
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+import httpx
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 
+try:
+    # LlmChat calls providers through litellm; it is only imported to share its HTTP client
+    import litellm
+except ImportError:
+    litellm = None
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -42,6 +71,126 @@ def serialize_doc(doc):
         doc['_id'] = str(doc['_id'])
     return doc
 
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def version_filter(version: int) -> Dict[str, Any]:
+    # Files written before versioning have no version field
+    if version == 0:
+        return {"version": {"$in": [None, 0]}}
+    return {"version": version}
+
+PROJECT_TOUCH_FLUSH_MS = int(os.environ.get('PROJECT_TOUCH_FLUSH_MS', '500'))
+
+class ProjectTouchWriter:
+    """
+    Coalesces project `updated_at` bumps. Touches are buffered per project and written
+    with a single bulk_write every flush interval, so a burst of autosaves on one
+    project costs one write instead of one per save.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._pending: Dict[str, datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def touch(self, project_id: str, when: datetime):
+        if project_id not in self._pending or when > self._pending[project_id]:
+            self._pending[project_id] = when
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        # $max so a late flush never moves a timestamp backwards
+        operations = [
+            UpdateOne({"_id": project_id}, {"$max": {"updated_at": when}})
+            for project_id, when in pending.items()
+        ]
+        try:
+            await db.projects.bulk_write(operations, ordered=False)
+        except Exception as e:
+            logger.error(f"Failed to flush project timestamps: {str(e)}")
+            for project_id, when in pending.items():
+                self.touch(project_id, when)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        await self.flush()
+
+project_touch_writer = ProjectTouchWriter(PROJECT_TOUCH_FLUSH_MS / 1000)
+
+# Indexes backing the list queries: files by project sorted by path,
+# chat history by session sorted by time, projects sorted by last update.
+# _id is the pagination tie-breaker, so it closes every sort key.
+INDEXES = {
+    "files": [
+        IndexModel([("project_id", 1), ("path", 1), ("_id", 1)]),
+        # Reference lookups when sweeping unused content chunks
+        IndexModel([("chunks.id", 1)]),
+    ],
+    "file_chunks": [IndexModel([("updated_at", 1)])],
+    "chat_history": [IndexModel([("session_id", 1), ("timestamp", 1), ("_id", 1)])],
+    "projects": [IndexModel([("updated_at", -1), ("_id", -1)])],
+}
+
+# Days chat messages are kept (0 keeps them forever); a session's summary
+# expires along with its latest message
+CHAT_HISTORY_TTL_DAYS = float(os.environ.get('CHAT_HISTORY_TTL_DAYS', '0'))
+if CHAT_HISTORY_TTL_DAYS > 0:
+    INDEXES["chat_history"].append(IndexModel([("timestamp", 1)], expireAfterSeconds=int(CHAT_HISTORY_TTL_DAYS * 86400)))
+    INDEXES["chat_sessions"] = [IndexModel([("updated_at", 1)], expireAfterSeconds=int(CHAT_HISTORY_TTL_DAYS * 86400))]
+
+async def ensure_indexes():
+    # create_indexes is a no-op for indexes that already exist
+    for collection, indexes in INDEXES.items():
+        try:
+            await db[collection].create_indexes(indexes)
+        except Exception as e:
+            logger.error(f"Failed to create indexes on {collection}: {str(e)}")
+
+# ==================== PAGINATION ====================
+
+# Keyset pagination: a cursor holds the sort key and _id of the last item on a page,
+# and the next page starts strictly after it. Cursors are returned in X-Next-Cursor.
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(value: Any, last_id: Any) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([value, str(last_id)])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def decode_cursor(cursor: str, is_datetime: bool = False) -> Tuple[Any, str]:
+    try:
+        value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if is_datetime:
+            value = datetime.fromisoformat(value)
+        return value, last_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def after_cursor(field: str, direction: int, value: Any, last_id: Any) -> Dict[str, Any]:
+    op = "$gt" if direction == 1 else "$lt"
+    return {"$or": [{field: {op: value}}, {field: value, "_id": {op: last_id}}]}
+
+def set_next_cursor(response: Response, page: List[Dict[str, Any]], page_size: int, field: str) -> List[Dict[str, Any]]:
+    # Pages are fetched with one extra item to learn whether another page exists
+    if len(page) > page_size:
+        page = page[:page_size]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(page[-1][field], page[-1]["_id"])
+    return page
+
 # ==================== MODELS ====================
 
 class ProjectCreate(BaseModel):
@@ -72,17 +221,57 @@ class File(BaseModel):
     path: str
     content: str
     language: str
+    version: int = 0  # Files saved before versioning report 0
+    hash: Optional[str] = None  # sha256 of content
     created_at: datetime
     updated_at: datetime
 
     class Config:
         populate_by_name = True
 
+class FileSummary(BaseModel):
+    id: str = Field(alias="_id")
+    name: str
+    path: str
+    language: str
+    size: int  # Content size in bytes
+    hash: Optional[str] = None
+    version: int = 0
+    updated_at: datetime
+
+    class Config:
+        populate_by_name = True
+
+class FileContent(BaseModel):
+    id: str
+    content: str
+    version: int = 0
+    hash: Optional[str] = None
+    offset: int = 0  # Character offset of `content` within the file, for range reads
+    total_length: Optional[int] = None  # Length of the whole file in characters
+
 class FileUpdate(BaseModel):
     content: Optional[str] = None
     name: Optional[str] = None
     path: Optional[str] = None
 
+class TextEdit(BaseModel):
+    # Offsets into the base version's content in UTF-16 code units, as JavaScript
+    # string indices count them; characters outside the BMP count as two
+    start: int
+    end: int
+    text: str
+
+class FilePatch(BaseModel):
+    base_version: int
+    edits: List[TextEdit]
+
+class FilePatchResponse(BaseModel):
+    id: str
+    version: int
+    hash: str
+    updated_at: datetime
+
 class ChatMessage(BaseModel):
     role: str  # 'user' or 'assistant'
     content: str
@@ -91,7 +280,7 @@ class ChatMessage(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     session_id: str
-    provider: str = "openai"  # openai, anthropic, gemini
+    provider: str = "openai"  # openai, anthropic, gemini, or "local" for the offline stand-in
     model: str = "gpt-5.2"
     context: Optional[str] = None  # Code context for better assistance
 
@@ -105,23 +294,30 @@ class CodeCompletionRequest(BaseModel):
     language: str
     provider: str = "openai"
     model: str = "gpt-5.2"
+    file_id: Optional[str] = None
+    client_id: Optional[str] = None  # A new request from the same client supersedes its previous one
 
 class CodeCompletionResponse(BaseModel):
     completion: str
     suggestions: List[str]
+    cached: bool = False
+    cancelled: bool = False  # Superseded by a newer request from the same client
 
 class CodeExecutionRequest(BaseModel):
     code: str
     language: str
     inputs: Optional[List[str]] = []
+    use_cache: bool = True  # Serve repeated runs of identical code from the result cache
 
 class CodeExecutionResponse(BaseModel):
     output: str
     error: Optional[str] = None
     execution_time: float
+    cached: bool = False
 
 class AIFileOperation(BaseModel):
     operation: str  # 'create', 'edit', 'refactor'
+    file_id: Optional[str] = None  # Set for edits of an existing project file
     file_name: str
     file_path: str
     content: str
@@ -152,6 +348,32 @@ class ApplyAIOperationRequest(BaseModel):
     content: str
     language: str
 
+class ArchiveSkippedFile(BaseModel):
+    path: str
+    reason: str
+
+class ProjectImportResponse(BaseModel):
+    project: Project
+    imported: int
+    skipped: int
+    skipped_files: List[ArchiveSkippedFile] = []  # First IMPORT_MAX_REPORTED_SKIPS only
+
+class ApplyAIOperationsRequest(BaseModel):
+    project_id: str
+    operations: List[AIFileOperation]
+
+class AIOperationResult(BaseModel):
+    index: int  # Position in the request
+    operation: str
+    success: bool
+    file_id: Optional[str] = None
+    error: Optional[str] = None
+
+class ApplyAIOperationsResponse(BaseModel):
+    applied: int
+    transactional: bool  # All-or-nothing when true
+    results: List[AIOperationResult]
+
 # ==================== PROJECT ENDPOINTS ====================
 
 @api_router.post("/projects", response_model=Project)
@@ -168,8 +390,19 @@ async def create_project(project: ProjectCreate):
     return Project(**project_doc)
 
 @api_router.get("/projects", response_model=List[Project])
-async def get_projects():
-    projects = await db.projects.find().sort("updated_at", -1).to_list(100)
+async def get_projects(
+    response: Response,
+    cursor: Optional[str] = None,
+    page_size: int = Query(100, ge=1, le=500)
+):
+    query = {}
+    if cursor:
+        updated_at, last_id = decode_cursor(cursor, is_datetime=True)
+        query = after_cursor("updated_at", -1, updated_at, last_id)
+    projects = await db.projects.find(query).sort(
+        [("updated_at", -1), ("_id", -1)]
+    ).limit(page_size + 1).to_list(page_size + 1)
+    projects = set_next_cursor(response, projects, page_size, "updated_at")
     return [Project(**serialize_doc(p)) for p in projects]
 
 @api_router.get("/projects/{project_id}", response_model=Project)
@@ -186,8 +419,199 @@ async def delete_project(project_id: str):
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Project not found")
     await db.files.delete_many({"project_id": project_id})
+    project_indexes.project_deleted(project_id)
     return {"message": "Project deleted successfully"}
 
+# ==================== FILE CONTENT STORAGE ====================
+
+# Content above this many bytes is stored as content-addressed chunk documents in
+# `file_chunks`, keeping file documents small and far from the 16 MB BSON limit
+FILE_CHUNK_THRESHOLD = int(os.environ.get('FILE_CHUNK_THRESHOLD', str(512 * 1024)))
+# Average chunk size; boundaries are content-defined, between a quarter and four times this
+FILE_CHUNK_CHARS = int(os.environ.get('FILE_CHUNK_CHARS', str(64 * 1024)))
+FILE_CHUNK_MIN_CHARS = FILE_CHUNK_CHARS // 4
+FILE_CHUNK_MAX_CHARS = FILE_CHUNK_CHARS * 4
+FILE_CHUNK_SWEEP_INTERVAL = float(os.environ.get('FILE_CHUNK_SWEEP_INTERVAL', '3600'))
+# Chunks written within this many seconds are never swept, so a save in progress is safe
+FILE_CHUNK_SWEEP_GRACE = 3600
+FILE_CHUNK_SWEEP_BATCH = 500
+DUPLICATE_KEY_ERROR = 11000
+# Over-long lines (minified code) are cut after statement and block delimiters instead
+CHUNK_PIECE_PATTERN = re.compile(r"[^;{}]*[;{}]?")
+
+def chunk_pieces(content: str):
+    for line in content.splitlines(keepends=True):
+        if len(line) <= FILE_CHUNK_MIN_CHARS:
+            yield line
+        else:
+            yield from (piece for piece in CHUNK_PIECE_PATTERN.findall(line) if piece)
+
+def split_chunks(content: str) -> List[str]:
+    """
+    Split content into chunks whose boundaries depend only on nearby text: a chunk
+    ends after a line whose crc32 falls in a range proportional to its length. An
+    insert or delete then changes only the chunk it lands in, instead of shifting
+    every chunk after it as fixed-size offsets would.
+    """
+    chunks = []
+    start = end = 0
+    for piece in chunk_pieces(content):
+        end += len(piece)
+        while end - start > FILE_CHUNK_MAX_CHARS:
+            chunks.append(content[start:start + FILE_CHUNK_MAX_CHARS])
+            start += FILE_CHUNK_MAX_CHARS
+        if end - start >= FILE_CHUNK_MIN_CHARS and zlib.crc32(piece.encode()) % FILE_CHUNK_CHARS < len(piece):
+            chunks.append(content[start:end])
+            start = end
+    if start < len(content):
+        chunks.append(content[start:])
+    return chunks
+
+async def store_chunks(texts: Dict[str, str]):
+    """
+    Make sure every chunk is stored, sending text only for chunks not stored yet.
+    Chunks already stored just get their timestamp refreshed, which keeps them
+    from being swept.
+    """
+    now = datetime.utcnow()
+    existing = set(await db.file_chunks.distinct("_id", {"_id": {"$in": list(texts)}}))
+    writes = [
+        InsertOne({"_id": chunk_id, "data": text, "length": len(text), "updated_at": now})
+        for chunk_id, text in texts.items() if chunk_id not in existing
+    ]
+    if existing:
+        writes.append(UpdateMany({"_id": {"$in": list(existing)}}, {"$set": {"updated_at": now}}))
+    try:
+        matched = (await db.file_chunks.bulk_write(writes, ordered=False)).matched_count
+    except BulkWriteError as e:
+        # A concurrent save inserting the same chunk is fine
+        if any(error.get("code") != DUPLICATE_KEY_ERROR for error in e.details.get("writeErrors", [])):
+            raise
+        matched = e.details.get("nMatched", 0)
+    if matched < len(existing):
+        # Swept between the lookup and the refresh: write those back in full
+        await db.file_chunks.bulk_write([
+            UpdateOne(
+                {"_id": chunk_id},
+                {"$setOnInsert": {"data": texts[chunk_id], "length": len(texts[chunk_id])}, "$set": {"updated_at": now}},
+                upsert=True
+            )
+            for chunk_id in existing
+        ], ordered=False)
+
+async def content_fields(content: str) -> Dict[str, Any]:
+    """
+    Fields stored alongside every write of a file's content. Large content goes to
+    chunk documents keyed by the sha256 of their text: a save only uploads the
+    chunks that changed, and identical chunks are stored once.
+    """
+    encoded = content.encode()
+    fields = {
+        "hash": hashlib.sha256(encoded).hexdigest(),
+        "size": len(encoded),
+        "length": len(content),
+    }
+    if len(encoded) <= FILE_CHUNK_THRESHOLD:
+        return {"content": content, "chunks": None, **fields}
+    
+    chunks = []
+    texts = {}
+    for text in await asyncio.to_thread(split_chunks, content):
+        chunk_id = hashlib.sha256(text.encode()).hexdigest()
+        chunks.append({"id": chunk_id, "length": len(text)})
+        texts[chunk_id] = text
+    await store_chunks(texts)
+    return {"content": None, "chunks": chunks, **fields}
+
+async def load_content(file_doc: Dict[str, Any], start: int = 0, end: Optional[int] = None) -> str:
+    """
+    A file's content, or its [start, end) character range, wherever it is stored.
+    For chunked files only the chunks overlapping the range are read.
+    """
+    chunks = file_doc.get("chunks")
+    if not chunks:
+        return (file_doc.get("content") or "")[start:end]
+    
+    wanted = []
+    first_offset = None
+    offset = 0
+    for chunk in chunks:
+        if offset + chunk["length"] > start and (end is None or offset < end):
+            wanted.append(chunk["id"])
+            if first_offset is None:
+                first_offset = offset
+        offset += chunk["length"]
+    if not wanted:
+        return ""
+    
+    stored = await db.file_chunks.find({"_id": {"$in": list(set(wanted))}}, {"data": 1}).to_list(None)
+    texts = {chunk["_id"]: chunk["data"] for chunk in stored}
+    missing = set(wanted) - texts.keys()
+    if missing:
+        raise RuntimeError(f"File {file_doc.get('_id')} is missing {len(missing)} content chunks")
+    text = "".join(texts[chunk_id] for chunk_id in wanted)
+    return text[start - first_offset:None if end is None else end - first_offset]
+
+async def with_content(file_doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Fill in `content` for a chunked file document before returning it whole."""
+    if file_doc.get("chunks") and file_doc.get("content") is None:
+        file_doc["content"] = await load_content(file_doc)
+    return file_doc
+
+class FileChunkSweeper:
+    """
+    Deletes content chunks no file references any more. Chunks are shared between
+    files and versions, so instead of reference counting on every save, chunks
+    untouched for the grace period are periodically checked against the files.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def sweep(self) -> int:
+        cutoff = datetime.utcnow() - timedelta(seconds=FILE_CHUNK_SWEEP_GRACE)
+        removed = 0
+        batch = []
+        cursor = db.file_chunks.find({"updated_at": {"$lt": cutoff}}, {"_id": 1})
+        async for chunk in cursor:
+            batch.append(chunk["_id"])
+            if len(batch) >= FILE_CHUNK_SWEEP_BATCH:
+                removed += await self._remove_unreferenced(batch, cutoff)
+                batch = []
+        if batch:
+            removed += await self._remove_unreferenced(batch, cutoff)
+        return removed
+
+    async def _remove_unreferenced(self, chunk_ids: List[str], cutoff: datetime) -> int:
+        referenced = set(await db.files.distinct("chunks.id", {"chunks.id": {"$in": chunk_ids}}))
+        unreferenced = [chunk_id for chunk_id in chunk_ids if chunk_id not in referenced]
+        if not unreferenced:
+            return 0
+        # Re-check the timestamp: a save may have picked a chunk up since the scan
+        result = await db.file_chunks.delete_many({"_id": {"$in": unreferenced}, "updated_at": {"$lt": cutoff}})
+        return result.deleted_count
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                removed = await self.sweep()
+                if removed:
+                    logger.info(f"Removed {removed} unused content chunks")
+            except Exception as e:
+                logger.error(f"Content chunk sweep failed: {str(e)}")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+file_chunk_sweeper = FileChunkSweeper(FILE_CHUNK_SWEEP_INTERVAL)
+
 # ==================== FILE ENDPOINTS ====================
 
 @api_router.post("/files", response_model=File)
@@ -198,32 +622,103 @@ async def create_file(file: FileCreate):
         "project_id": file.project_id,
         "name": file.name,
         "path": file.path,
-        "content": file.content,
+        **(await content_fields(file.content)),
         "language": file.language,
+        "version": 1,
         "created_at": now,
         "updated_at": now
     }
     await db.files.insert_one(file_doc)
     
     # Update project's updated_at
-    await db.projects.update_one(
-        {"_id": file.project_id},
-        {"$set": {"updated_at": now}}
-    )
+    project_touch_writer.touch(file.project_id, now)
+    project_indexes.file_saved(file_doc)
     
-    return File(**file_doc)
+    return File(**{**file_doc, "content": file.content})
 
 @api_router.get("/files/project/{project_id}", response_model=List[File])
-async def get_project_files(project_id: str):
-    files = await db.files.find({"project_id": project_id}).sort("path", 1).to_list(1000)
-    return [File(**serialize_doc(f)) for f in files]
+async def get_project_files(
+    project_id: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    page_size: int = Query(1000, ge=1, le=1000)
+):
+    query = {"project_id": project_id}
+    if cursor:
+        query.update(after_cursor("path", 1, *decode_cursor(cursor)))
+    files = await db.files.find(query).sort(
+        [("path", 1), ("_id", 1)]
+    ).limit(page_size + 1).to_list(page_size + 1)
+    files = set_next_cursor(response, files, page_size, "path")
+    return [File(**serialize_doc(await with_content(f))) for f in files]
+
+@api_router.get("/files/project/{project_id}/summary", response_model=List[FileSummary])
+async def get_project_file_summaries(
+    project_id: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    page_size: int = Query(1000, ge=1, le=5000)
+):
+    """
+    List a project's files without their content, for the editor sidebar.
+    Fetch a file's content separately with GET /files/{file_id}/content.
+    """
+    query = {"project_id": project_id}
+    if cursor:
+        query.update(after_cursor("path", 1, *decode_cursor(cursor)))
+    files = await db.files.aggregate([
+        {"$match": query},
+        {"$sort": {"path": 1, "_id": 1}},
+        {"$limit": page_size + 1},
+        {"$project": {
+            "name": 1,
+            "path": 1,
+            "language": 1,
+            "hash": 1,
+            "version": 1,
+            "updated_at": 1,
+            # Files saved before sizes were stored: measure on the server, don't ship the content
+            "size": {"$ifNull": ["$size", {"$strLenBytes": "$content"}]},
+        }},
+    ]).to_list(page_size + 1)
+    files = set_next_cursor(response, files, page_size, "path")
+    return [FileSummary(**f) for f in files]
+
+@api_router.get("/files/{file_id}/content", response_model=FileContent)
+async def get_file_content(
+    file_id: str,
+    offset: int = Query(0, ge=0),
+    length: Optional[int] = Query(None, ge=0)
+):
+    """
+    A file's content, or with `offset`/`length` (in characters) just that range,
+    so the editor can load large files progressively.
+    """
+    file = await db.files.find_one(
+        {"_id": file_id},
+        {"content": 1, "chunks": 1, "length": 1, "version": 1, "hash": 1}
+    )
+    if not file:
+        raise HTTPException(status_code=404, detail="File not found")
+    content = await load_content(file, offset, None if length is None else offset + length)
+    total_length = file.get("length")
+    if total_length is None and file.get("content") is not None:
+        total_length = len(file["content"])
+    return FileContent(
+        id=file_id,
+        content=content,
+        version=file.get("version") or 0,
+        hash=file.get("hash"),
+        offset=offset,
+        total_length=total_length
+    )
 
 @api_router.get("/files/{file_id}", response_model=File)
 async def get_file(file_id: str):
     file = await db.files.find_one({"_id": file_id})
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
-    return File(**serialize_doc(file))
+    return File(**serialize_doc(await with_content(file)))
 
 @api_router.put("/files/{file_id}", response_model=File)
 async def update_file(file_id: str, file_update: FileUpdate):
@@ -231,286 +726,1803 @@ async def update_file(file_id: str, file_update: FileUpdate):
     if not update_data:
         raise HTTPException(status_code=400, detail="No fields to update")
     
+    content = update_data.get("content")
+    if content is not None:
+        update_data.update(await content_fields(content))
     update_data["updated_at"] = datetime.utcnow()
     
-    result = await db.files.update_one(
+    # Single round trip: update and read back the new document together
+    updated_file = await db.files.find_one_and_update(
         {"_id": file_id},
-        {"$set": update_data}
+        {"$set": update_data, "$inc": {"version": 1}},
+        return_document=ReturnDocument.AFTER
     )
     
-    if result.matched_count == 0:
+    if not updated_file:
         raise HTTPException(status_code=404, detail="File not found")
     
     # Update project's updated_at
-    file_doc = await db.files.find_one({"_id": file_id})
-    if file_doc:
-        await db.projects.update_one(
-            {"_id": file_doc["project_id"]},
-            {"$set": {"updated_at": update_data["updated_at"]}}
-        )
+    project_touch_writer.touch(updated_file["project_id"], update_data["updated_at"])
+    project_indexes.file_saved(updated_file)
+    
+    if content is not None:
+        updated_file["content"] = content
+    return File(**serialize_doc(await with_content(updated_file)))
+
+def apply_text_edits(content: str, edits: List[TextEdit]) -> str:
+    encoded = content.encode("utf-16-le", "surrogatepass")
+    utf16_length = len(encoded) // 2
+    reached = [0, 0]  # UTF-16 offset converted so far and its string index
+    
+    def to_index(offset: int) -> int:
+        if utf16_length == len(content):
+            return offset
+        # Offsets only grow, so each conversion decodes just the text since the last one
+        text = encoded[reached[0] * 2:offset * 2].decode("utf-16-le", "surrogatepass")
+        if text and "\ud800" <= text[-1] <= "\udbff":
+            raise HTTPException(status_code=400, detail=f"Edit offset {offset} splits a surrogate pair")
+        reached[0] = offset
+        reached[1] += len(text)
+        return reached[1]
+    
+    ordered = sorted(edits, key=lambda e: (e.start, e.end))
+    pieces = []
+    position = 0
+    previous_end = 0
+    for edit in ordered:
+        if edit.start < previous_end or edit.end < edit.start or edit.end > utf16_length:
+            raise HTTPException(status_code=400, detail=f"Invalid edit range {edit.start}-{edit.end}")
+        start = to_index(edit.start)
+        pieces.append(content[position:start])
+        pieces.append(edit.text)
+        position = to_index(edit.end)
+        previous_end = edit.end
+    pieces.append(content[position:])
+    return "".join(pieces)
+
+@api_router.patch("/files/{file_id}", response_model=FilePatchResponse)
+async def patch_file(file_id: str, patch: FilePatch):
+    """
+    Apply text edits to a file without resending its whole content.
+    Edits are UTF-16 ranges into the content at `base_version`; if the file has
+    moved on since then the patch is rejected with 409 and the client must rebase.
+    """
+    file_doc = await db.files.find_one(
+        {"_id": file_id},
+        {"project_id": 1, "name": 1, "path": 1, "language": 1, "content": 1, "chunks": 1, "version": 1}
+    )
+    if not file_doc:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    current_version = file_doc.get("version") or 0
+    if current_version != patch.base_version:
+        raise HTTPException(status_code=409, detail=f"Version conflict: file is at version {current_version}")
     
-    updated_file = await db.files.find_one({"_id": file_id})
-    return File(**serialize_doc(updated_file))
+    fields = await content_fields(apply_text_edits(await load_content(file_doc), patch.edits))
+    now = datetime.utcnow()
+    
+    # Optimistic concurrency: only succeeds if nobody saved since we read the file
+    result = await db.files.update_one(
+        {"_id": file_id, **version_filter(patch.base_version)},
+        {"$set": {**fields, "updated_at": now}, "$inc": {"version": 1}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=409, detail="Version conflict: file changed while applying patch")
+    
+    # Update project's updated_at
+    project_touch_writer.touch(file_doc["project_id"], now)
+    project_indexes.file_saved({**file_doc, **fields, "version": patch.base_version + 1})
+    
+    return FilePatchResponse(
+        id=file_id,
+        version=patch.base_version + 1,
+        hash=fields["hash"],
+        updated_at=now
+    )
 
 @api_router.delete("/files/{file_id}")
 async def delete_file(file_id: str):
-    file_doc = await db.files.find_one({"_id": file_id})
+    # Content chunks no longer used are left to file_chunk_sweeper
+    file_doc = await db.files.find_one({"_id": file_id}, {"project_id": 1})
     if not file_doc:
         raise HTTPException(status_code=404, detail="File not found")
     
     await db.files.delete_one({"_id": file_id})
     
     # Update project's updated_at
-    await db.projects.update_one(
-        {"_id": file_doc["project_id"]},
-        {"$set": {"updated_at": datetime.utcnow()}}
-    )
+    project_touch_writer.touch(file_doc["project_id"], datetime.utcnow())
+    project_indexes.file_deleted(file_doc["project_id"], file_id)
     
     return {"message": "File deleted successfully"}
 
-# ==================== AI CHAT ENDPOINTS ====================
+# ==================== PROJECT ARCHIVES ====================
 
-@api_router.post("/chat", response_model=ChatResponse)
-async def chat_with_ai(request: ChatRequest):
-    try:
-        api_key = os.environ.get('EMERGENT_LLM_KEY')
-        if not api_key:
-            raise HTTPException(status_code=500, detail="API key not configured")
-        
-        # Create system message for code assistance
-        system_message = "You are an expert programming assistant in a mobile IDE. Help users with code, debugging, explanations, and best practices. Be concise and practical."
-        if request.context:
-            system_message += f"\n\nCurrent code context:\n{request.context}"
-        
-        # Initialize chat
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=request.session_id,
-            system_message=system_message
-        ).with_model(request.provider, request.model)
-        
-        # Create user message
-        user_message = UserMessage(text=request.message)
-        
-        # Get response
-        response = await chat.send_message(user_message)
-        
-        # Store chat history
-        await db.chat_history.insert_one({
-            "session_id": request.session_id,
-            "role": "user",
-            "content": request.message,
-            "timestamp": datetime.utcnow()
-        })
-        
-        await db.chat_history.insert_one({
-            "session_id": request.session_id,
-            "role": "assistant",
-            "content": response,
-            "timestamp": datetime.utcnow()
-        })
-        
-        return ChatResponse(response=response, session_id=request.session_id)
-    
-    except Exception as e:
-        logger.error(f"Chat error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
+ARCHIVE_FORMATS = {
+    "zip": ("application/zip", "zip"),
+    "tar.gz": ("application/gzip", "tar.gz"),
+}
+# Files are read from Mongo and archived in batches of about this many bytes
+ARCHIVE_BATCH_BYTES = 4 * 1024 * 1024
+IMPORT_MAX_BYTES = int(os.environ.get('IMPORT_MAX_BYTES', str(200 * 1024 * 1024)))
+IMPORT_MAX_FILE_BYTES = int(os.environ.get('IMPORT_MAX_FILE_BYTES', str(1024 * 1024)))
+IMPORT_MAX_FILES = int(os.environ.get('IMPORT_MAX_FILES', '20000'))
+IMPORT_BATCH_FILES = 500
+IMPORT_MAX_REPORTED_SKIPS = 100
+IMPORT_SKIPPED_DIRECTORIES = {".git", "node_modules", "__pycache__", "__MACOSX", ".venv", "venv"}
 
-@api_router.get("/chat/history/{session_id}", response_model=List[ChatMessage])
-async def get_chat_history(session_id: str, limit: int = 50):
-    messages = await db.chat_history.find(
-        {"session_id": session_id}
-    ).sort("timestamp", -1).limit(limit).to_list(limit)
-    
-    return [ChatMessage(**msg) for msg in reversed(messages)]
+class ArchiveBuffer:
+    """Write-only file object the archive writers fill and the response drains."""
 
-# ==================== ENHANCED AI CHAT (CURSOR-LIKE) ====================
+    def __init__(self):
+        self._chunks: List[bytes] = []
 
-@api_router.post("/chat/enhanced", response_model=EnhancedChatResponse)
-async def enhanced_chat(request: EnhancedChatRequest):
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+class ProjectArchiveWriter:
     """
-    Enhanced AI chat with full project context and code generation capabilities.
-    Similar to Cursor AI - can generate, refactor, and create files.
+    Streams files into a zip or gzipped tar. Both are written without seeking, so
+    each batch's compressed bytes can be sent as soon as they are produced.
     """
-    try:
-        api_key = os.environ.get('EMERGENT_LLM_KEY')
-        if not api_key:
-            raise HTTPException(status_code=500, detail="API key not configured")
-        
-        # Build comprehensive context
-        context_parts = []
-        
-        # Get project info
-        project = await db.projects.find_one({"_id": request.project_id})
-        if project:
-            context_parts.append(f"Project: {project['name']}")
-            if project.get('description'):
-                context_parts.append(f"Description: {project['description']}")
-        
-        # Get all files in project for context
-        if request.include_project_context:
-            files = await db.files.find({"project_id": request.project_id}).to_list(100)
-            if files:
-                context_parts.append("\n=== Project Files ===")
-                for f in files:
-                    context_parts.append(f"\n--- {f['name']} ({f['language']}) ---")
-                    # Limit context size - truncate large files
-                    content = f['content'][:1000] if len(f['content']) > 1000 else f['content']
-                    context_parts.append(content)
-                    if len(f['content']) > 1000:
-                        context_parts.append(f"\n... (truncated, {len(f['content'])} chars total)")
-        
-        # Get current file content if specified
-        if request.current_file_id:
-            current_file = await db.files.find_one({"_id": request.current_file_id})
-            if current_file:
-                context_parts.append(f"\n=== Currently Editing: {current_file['name']} ===")
-                context_parts.append(current_file['content'])
-        
-        full_context = "\n".join(context_parts)
-        
-        # Create enhanced system message
-        system_message = """You are an expert AI coding assistant integrated into a mobile IDE (like Cursor AI).
 
-Your capabilities:
-1. **Code Generation**: Generate complete, working code for any language
-2. **File Creation**: Suggest creating new files when needed
-3. **Code Refactoring**: Improve existing code while maintaining functionality
-4. **Multi-file Operations**: Work across multiple files in a project
-5. **Explanations**: Explain code concepts clearly
+    def __init__(self, archive_format: str):
+        self.buffer = ArchiveBuffer()
+        if archive_format == "zip":
+            self.archive = zipfile.ZipFile(self.buffer, mode="w", compression=zipfile.ZIP_DEFLATED)
+        else:
+            self.archive = tarfile.open(fileobj=self.buffer, mode="w|gz")
 
-When suggesting code:
-- Use proper markdown code blocks with language tags (```python, ```javascript, etc.)
-- Be concise but complete
-- Include comments for complex logic
-- Follow best practices
+    def add(self, file_docs: List[Dict[str, Any]]) -> bytes:
+        for file_doc in file_docs:
+            path = normalize_file_path(file_doc.get("path") or file_doc["name"])
+            data = file_doc.get("content", "").encode()
+            modified = file_doc.get("updated_at") or datetime.utcnow()
+            if isinstance(self.archive, zipfile.ZipFile):
+                info = zipfile.ZipInfo(path, date_time=modified.timetuple()[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                self.archive.writestr(info, data)
+            else:
+                info = tarfile.TarInfo(path)
+                info.size = len(data)
+                info.mtime = int(modified.timestamp())
+                self.archive.addfile(info, io.BytesIO(data))
+        return self.buffer.drain()
 
-When creating/editing files:
-- Suggest the complete file content
-- Use descriptive file names
-- Include the file extension
+    def close(self) -> bytes:
+        self.archive.close()
+        return self.buffer.drain()
 
-Format your responses to be clear and actionable."""
-        
-        if full_context:
-            system_message += f"\n\nCurrent project context:\n{full_context}"
-        
-        # Initialize chat
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=request.session_id,
-            system_message=system_message
-        ).with_model(request.provider, request.model)
-        
-        # Create user message
-        user_message = UserMessage(text=request.message)
-        
-        # Get response
-        response = await chat.send_message(user_message)
-        
-        # Parse response for code blocks and suggested operations
-        code_blocks = []
-        suggested_operations = []
-        
-        # Extract code blocks from response
-        import re
-        code_block_pattern = r'```(\w+)?\n(.*?)```'
-        matches = re.finditer(code_block_pattern, response, re.DOTALL)
-        
-        for match in matches:
-            language = match.group(1) or 'text'
-            code = match.group(2).strip()
-            code_blocks.append({
-                'language': language,
-                'code': code,
-                'can_apply': True
-            })
-        
-        # Store chat history
-        await db.chat_history.insert_one({
-            "session_id": request.session_id,
-            "project_id": request.project_id,
-            "role": "user",
-            "content": request.message,
-            "timestamp": datetime.utcnow()
-        })
-        
-        await db.chat_history.insert_one({
-            "session_id": request.session_id,
-            "project_id": request.project_id,
-            "role": "assistant",
-            "content": response,
-            "code_blocks": code_blocks,
-            "timestamp": datetime.utcnow()
-        })
-        
-        return EnhancedChatResponse(
-            response=response,
-            session_id=request.session_id,
-            suggested_operations=suggested_operations,
-            code_blocks=code_blocks
-        )
+async def stream_project_archive(project_id: str, archive_format: str):
+    writer = ProjectArchiveWriter(archive_format)
+    batch = []
+    batch_bytes = 0
+    cursor = db.files.find(
+        {"project_id": project_id},
+        {"name": 1, "path": 1, "content": 1, "chunks": 1, "updated_at": 1}
+    ).sort([("path", 1), ("_id", 1)])
     
+    # Compression runs off the event loop, one batch at a time
+    async for file_doc in cursor:
+        batch.append(await with_content(file_doc))
+        batch_bytes += len(file_doc.get("content", ""))
+        if batch_bytes >= ARCHIVE_BATCH_BYTES:
+            data = await asyncio.to_thread(writer.add, batch)
+            batch = []
+            batch_bytes = 0
+            if data:
+                yield data
+    if batch:
+        data = await asyncio.to_thread(writer.add, batch)
+        if data:
+            yield data
+    yield await asyncio.to_thread(writer.close)
+
+@api_router.get("/projects/{project_id}/export")
+async def export_project(project_id: str, format: str = Query("zip", pattern="^(zip|tar\\.gz)$")):
+    """
+    Download a project's files as a zip or tar.gz archive. Files are streamed from a
+    database cursor into the archive, so memory stays flat however large the project.
+    """
+    project = await db.projects.find_one({"_id": project_id}, {"name": 1})
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    media_type, extension = ARCHIVE_FORMATS[format]
+    file_name = re.sub(r"[^\w.-]+", "_", project["name"]).strip("_") or "project"
+    return StreamingResponse(
+        stream_project_archive(project_id, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{file_name}.{extension}"'}
+    )
+
+def iter_archive(archive_file) -> Any:
+    """(path, data) for each regular file of a zip or tar archive; data is None above IMPORT_MAX_FILE_BYTES."""
+    archive_file.seek(0)
+    if zipfile.is_zipfile(archive_file):
+        archive_file.seek(0)
+        with zipfile.ZipFile(archive_file) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    yield info.filename, archive.read(info) if info.file_size <= IMPORT_MAX_FILE_BYTES else None
+        return
+    
+    archive_file.seek(0)
+    with tarfile.open(fileobj=archive_file, mode="r:*") as archive:
+        for member in archive:
+            if member.isfile():
+                yield member.name, archive.extractfile(member).read() if member.size <= IMPORT_MAX_FILE_BYTES else None
+
+def next_archive_batch(entries) -> List[Tuple[str, Optional[bytes]]]:
+    batch = []
+    batch_bytes = 0
+    for path, data in entries:
+        batch.append((path, data))
+        batch_bytes += len(data or b"")
+        if len(batch) >= IMPORT_BATCH_FILES or batch_bytes >= ARCHIVE_BATCH_BYTES:
+            break
+    return batch
+
+def archive_entry_path(path: str) -> str:
+    return posixpath.normpath(normalize_file_path(path))
+
+async def archive_file_doc(project_id: str, path: str, data: Optional[bytes], now: datetime) -> Tuple[Optional[Dict[str, Any]], str]:
+    """The file document for an archive entry, or None and the reason it is skipped."""
+    path = archive_entry_path(path)
+    parts = path.split("/")
+    if path.startswith("..") or path == ".":
+        return None, "outside the project"
+    if IMPORT_SKIPPED_DIRECTORIES.intersection(parts[:-1]):
+        return None, "tool directory"
+    if data is None:
+        return None, "too large"
+    try:
+        content = data.decode("utf-8")
+    except UnicodeDecodeError:
+        return None, "binary"
+    if "\x00" in content:
+        return None, "binary"
+    return {
+        "_id": str(ObjectId()),
+        "project_id": project_id,
+        "name": parts[-1],
+        "path": f"/{path}",
+        **(await content_fields(content)),
+        "language": language_for_path(path),
+        "version": 1,
+        "created_at": now,
+        "updated_at": now
+    }, ""
+
+async def discard_import(project_id: str):
+    try:
+        await db.files.delete_many({"project_id": project_id})
+        await db.projects.delete_one({"_id": project_id})
     except Exception as e:
-        logger.error(f"Enhanced chat error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
+        logger.error(f"Failed to remove partly imported project {project_id}: {str(e)}")
 
-@api_router.post("/ai/apply-operation")
-async def apply_ai_operation(request: ApplyAIOperationRequest):
+@api_router.post("/projects/import", response_model=ProjectImportResponse)
+async def import_project(
+    archive: UploadFile = UploadField(...),
+    name: Optional[str] = Query(None, min_length=1),
+    description: str = ""
+):
     """
-    Apply AI-suggested operations: create new file, edit existing file, or refactor code.
+    Create a project from an uploaded zip or tar(.gz) archive. The upload is spooled
+    to disk, then read back in batches that are each stored with one insert_many.
+    Binary files, files over IMPORT_MAX_FILE_BYTES and tool directories such as
+    .git and node_modules are skipped and reported. When a path appears more than
+    once the last entry wins, as extracting the archive would leave it.
     """
+    if archive.size is not None and archive.size > IMPORT_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Archive larger than {IMPORT_MAX_BYTES} bytes")
+    
+    entries = iter_archive(archive.file)
     try:
-        now = datetime.utcnow()
-        
-        if request.operation == 'create':
-            # Create new file
-            file_doc = {
-                "_id": str(ObjectId()),
-                "project_id": request.project_id,
-                "name": request.file_name,
-                "path": request.file_path,
-                "content": request.content,
-                "language": request.language,
-                "created_at": now,
-                "updated_at": now
-            }
-            await db.files.insert_one(file_doc)
-            
-            # Update project timestamp
-            await db.projects.update_one(
-                {"_id": request.project_id},
-                {"$set": {"updated_at": now}}
-            )
-            
-            return {
-                "success": True,
-                "message": "File created successfully",
-                "file_id": file_doc["_id"],
-                "operation": "create"
-            }
+        batch = await asyncio.to_thread(next_archive_batch, entries)
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError):
+        raise HTTPException(status_code=400, detail="Unsupported or corrupt archive, expected zip or tar")
+    
+    now = datetime.utcnow()
+    project_name = name or re.sub(r"(\.zip|\.tar|\.tar\.gz|\.tgz)$", "", archive.filename or "") or "Imported project"
+    project_doc = {
+        "_id": str(ObjectId()),
+        "name": project_name,
+        "description": description,
+        "created_at": now,
+        "updated_at": now
+    }
+    await db.projects.insert_one(project_doc)
+    
+    imported: Dict[str, str] = {}  # File id by path, for files already stored
+    skipped: Dict[str, ArchiveSkippedFile] = {}
+    try:
+        while batch:
+            file_docs: Dict[str, Dict[str, Any]] = {}
+            superseded = []
+            for path, data in batch:
+                file_doc, reason = await archive_file_doc(project_doc["_id"], path, data, now)
+                key = archive_entry_path(path)
+                # A repeated path replaces whatever an earlier entry left for it
+                file_docs.pop(key, None)
+                skipped.pop(key, None)
+                if key in imported:
+                    superseded.append(imported.pop(key))
+                if not file_doc:
+                    skipped[key] = ArchiveSkippedFile(path=path, reason=reason)
+                elif len(imported) + len(file_docs) >= IMPORT_MAX_FILES:
+                    skipped[key] = ArchiveSkippedFile(path=path, reason="file limit reached")
+                else:
+                    file_docs[key] = file_doc
+            if superseded:
+                await db.files.delete_many({"_id": {"$in": superseded}})
+            if file_docs:
+                await db.files.insert_many(list(file_docs.values()), ordered=False)
+                imported.update((key, file_doc["_id"]) for key, file_doc in file_docs.items())
+            batch = await asyncio.to_thread(next_archive_batch, entries)
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError, zlib.error) as e:
+        await discard_import(project_doc["_id"])
+        raise HTTPException(status_code=400, detail=f"Corrupt archive: {str(e)}")
+    except BaseException:
+        # Database errors and cancelled requests too: never leave a half-imported project
+        await discard_import(project_doc["_id"])
+        raise
+    
+    return ProjectImportResponse(
+        project=Project(**project_doc),
+        imported=len(imported),
+        skipped=len(skipped),
+        skipped_files=list(skipped.values())[:IMPORT_MAX_REPORTED_SKIPS]
+    )
+
+# ==================== LLM PROVIDERS ====================
+
+LOCAL_LLM_PROVIDER = "local"
+# Offline stand-in model, for load testing the AI endpoints without spending tokens
+LOCAL_LLM_LATENCY_MS = float(os.environ.get('LOCAL_LLM_LATENCY_MS', '300'))
+LOCAL_LLM_LATENCY_SIGMA = float(os.environ.get('LOCAL_LLM_LATENCY_SIGMA', '0.5'))
+LOCAL_LLM_TOKENS_PER_SECOND = float(os.environ.get('LOCAL_LLM_TOKENS_PER_SECOND', '60'))
+LOCAL_LLM_REPLY_TOKENS = int(os.environ.get('LOCAL_LLM_REPLY_TOKENS', '150'))
+LOCAL_LLM_SEED = os.environ.get('LOCAL_LLM_SEED', 'mobileide')
+# Concurrent requests above which the local provider answers 429 (0 = never)
+LOCAL_LLM_RATE_LIMIT = int(os.environ.get('LOCAL_LLM_RATE_LIMIT', '0'))
+LOCAL_LLM_WORDS = (
+    "the function returns value when input list is empty so we check length first then "
+    "loop over items and build result using helper that handles errors and edge cases"
+).split()
+
+# Outbound call limits, per provider and model
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', '8'))
+LLM_MAX_QUEUE = int(os.environ.get('LLM_MAX_QUEUE', '32'))
+LLM_MAX_WAIT = float(os.environ.get('LLM_MAX_WAIT', '15'))
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', '2'))
+LLM_RETRY_BASE_DELAY = float(os.environ.get('LLM_RETRY_BASE_DELAY', '0.5'))
+LLM_BUSY_RETRY_AFTER = 2
+# Pooled upstream HTTP connections
+LLM_HTTP_MAX_CONNECTIONS = int(os.environ.get('LLM_HTTP_MAX_CONNECTIONS', '64'))
+LLM_HTTP_KEEPALIVE_EXPIRY = float(os.environ.get('LLM_HTTP_KEEPALIVE_EXPIRY', '120'))
+LLM_HTTP_TIMEOUT = 600
+RATE_LIMIT_PATTERN = re.compile(r"\b429\b|rate.?limit|too many requests", re.IGNORECASE)
+# Emergent universal keys are only accepted by Emergent's OpenAI-compatible proxy, as LlmChat does
+EMERGENT_KEY_PREFIX = "sk-emergent-"
+EMERGENT_LLM_PROXY_URL = os.environ.get('INTEGRATION_PROXY_URL', 'https://integrations.emergentagent.com') + '/llm'
+
+def get_llm_api_key() -> str:
+    api_key = os.environ.get('EMERGENT_LLM_KEY')
+    if not api_key:
+        raise HTTPException(status_code=500, detail="API key not configured")
+    return api_key
+
+class LlmHttpClient:
+    """
+    One long-lived HTTP client for all upstream model calls, started with the app.
+    httpx keeps a separate keep-alive pool per host, so every provider and model
+    reuses warm connections instead of paying a TCP and TLS handshake per request.
+    LlmChat takes no client argument; it reaches providers through litellm, which
+    uses `litellm.aclient_session` when set.
+    """
+
+    def __init__(self):
+        self.client: Optional[httpx.AsyncClient] = None
+
+    def start(self):
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_HTTP_MAX_CONNECTIONS,
+                keepalive_expiry=LLM_HTTP_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(LLM_HTTP_TIMEOUT, connect=10.0)
+        )
+        if litellm is None:
+            logger.warning("litellm not available, LLM calls will not share pooled connections")
+            return
+        litellm.aclient_session = self.client
+
+    async def stop(self):
+        if not self.client:
+            return
+        if litellm is not None and litellm.aclient_session is self.client:
+            litellm.aclient_session = None
+        await self.client.aclose()
+        self.client = None
+
+llm_http = LlmHttpClient()
+
+class LlmBusy(Exception):
+    pass
+
+def llm_busy_error() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="AI service is busy, try again shortly",
+        headers={"Retry-After": str(LLM_BUSY_RETRY_AFTER)}
+    )
+
+def is_rate_limited(error: Exception) -> bool:
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or bool(RATE_LIMIT_PATTERN.search(str(error)))
+
+class LlmLimiter:
+    """
+    Caps concurrent upstream calls per (provider, model).
+    Callers beyond the cap queue first come, first served, and a freed slot passes
+    straight to the head of the queue. Once `max_queue` callers are waiting, or a
+    caller has waited `max_wait` seconds, LlmBusy is raised so the API can answer
+    503 at once instead of piling up requests the provider would reject anyway.
+    """
+
+    def __init__(self, concurrency: int, max_queue: int, max_wait: float):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._running: Dict[Tuple[str, str], int] = {}
+        self._queues: Dict[Tuple[str, str], deque] = {}
+
+    def full(self, provider: str, model: str) -> bool:
+        key = (provider, model)
+        return self._running.get(key, 0) >= self.concurrency and len(self._queues.get(key, ())) >= self.max_queue
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            f"{provider}/{model}": {"running": running, "waiting": len(self._queues.get((provider, model), ()))}
+            for (provider, model), running in self._running.items()
+        }
+
+    @asynccontextmanager
+    async def slot(self, provider: str, model: str):
+        key = (provider, model)
+        queue = self._queues.setdefault(key, deque())
+        if self._running.get(key, 0) < self.concurrency and not queue:
+            self._running[key] = self._running.get(key, 0) + 1
+        elif len(queue) >= self.max_queue:
+            raise LlmBusy()
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            queue.append(waiter)
+            try:
+                # Not wait_for: it swallows a cancel that lands as the slot is handed over
+                await asyncio.wait((waiter,), timeout=self.max_wait)
+            except BaseException:
+                if waiter.done():
+                    # The slot was handed over just as we were cancelled
+                    self._release(key)
+                else:
+                    queue.remove(waiter)
+                raise
+            if not waiter.done():
+                queue.remove(waiter)
+                raise LlmBusy()
+        try:
+            yield
+        finally:
+            self._release(key)
+
+    def _release(self, key: Tuple[str, str]):
+        queue = self._queues.get(key)
+        if queue:
+            queue.popleft().set_result(None)
+            return
+        self._running[key] -= 1
+        if not self._running[key]:
+            del self._running[key]
+            self._queues.pop(key, None)
+
+llm_limiter = LlmLimiter(LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_MAX_WAIT)
+
+async def retry_delay(attempt: int, error: Exception):
+    """Back off after a rate-limited call, or give up with LlmBusy once retries are spent."""
+    if attempt >= LLM_MAX_RETRIES:
+        raise LlmBusy() from error
+    # Full jitter, so retries from a burst of callers spread out instead of colliding
+    delay = random.uniform(0, LLM_RETRY_BASE_DELAY * 2 ** attempt)
+    logger.warning(f"LLM rate limited, retrying in {delay:.2f}s: {str(error)}")
+    await asyncio.sleep(delay)
+
+class LlmSession:
+    """
+    A model conversation as the endpoints use it: `send` returns the whole reply,
+    `stream` yields it in text chunks. Both hold a slot of `llm_limiter` and retry
+    rate-limited calls. Backends implement `request`, and `request_stream` when they
+    can stream; otherwise the reply is delivered as a single chunk.
+    """
+
+    def __init__(self, provider: str, model: str, session_id: str, system_message: str):
+        self.provider = provider
+        self.model = model
+        self.session_id = session_id
+        self.system_message = system_message
+
+    async def request(self, text: str) -> str:
+        raise NotImplementedError
+
+    async def request_stream(self, text: str):
+        yield await self.request(text)
+
+    async def send(self, text: str) -> str:
+        async with llm_limiter.slot(self.provider, self.model):
+            for attempt in itertools.count():
+                try:
+                    return await self.request(text)
+                except Exception as e:
+                    if not is_rate_limited(e):
+                        raise
+                    await retry_delay(attempt, e)
+
+    async def stream(self, text: str):
+        async with llm_limiter.slot(self.provider, self.model):
+            for attempt in itertools.count():
+                started = False
+                try:
+                    async for chunk in self.request_stream(text):
+                        started = True
+                        yield chunk
+                    return
+                except Exception as e:
+                    # Only a stream that has not produced anything yet can be retried
+                    if started or not is_rate_limited(e):
+                        raise
+                    await retry_delay(attempt, e)
+
+class EmergentLlmSession(LlmSession):
+    """
+    Hosted models (openai, anthropic, gemini). Whole replies go through
+    emergentintegrations' LlmChat, which only returns complete messages; streams
+    call litellm directly, the library LlmChat itself sends requests with, so
+    tokens are forwarded as the provider produces them.
+    """
+
+    def __init__(self, provider: str, model: str, session_id: str, system_message: str):
+        super().__init__(provider, model, session_id, system_message)
+        self.api_key = get_llm_api_key()
+        self.chat = LlmChat(
+            api_key=self.api_key,
+            session_id=session_id,
+            system_message=system_message
+        ).with_model(provider, model)
+
+    async def request(self, text: str) -> str:
+        return await self.chat.send_message(UserMessage(text=text))
+
+    def completion_params(self) -> Dict[str, Any]:
+        params = {"model": f"{self.provider}/{self.model}", "api_key": self.api_key}
+        if self.api_key.startswith(EMERGENT_KEY_PREFIX):
+            params.update(api_base=EMERGENT_LLM_PROXY_URL, custom_llm_provider="openai")
+        return params
+
+    async def request_stream(self, text: str):
+        if litellm is None:
+            yield await self.request(text)
+            return
+        response = await litellm.acompletion(
+            messages=[
+                {"role": "system", "content": self.system_message},
+                {"role": "user", "content": text},
+            ],
+            stream=True,
+            **self.completion_params()
+        )
+        try:
+            async for chunk in response:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        finally:
+            # Stop reading the upstream response when the client goes away mid-stream
+            close = getattr(response, "aclose", None)
+            if close:
+                await close()
+
+class LocalRateLimitError(Exception):
+    status_code = 429
+
+class LocalLlmSession(LlmSession):
+    """
+    Deterministic offline model: the same model and prompt always give the same reply
+    and the same timing. Time to first token is drawn from a lognormal distribution
+    around LOCAL_LLM_LATENCY_MS, then tokens arrive at LOCAL_LLM_TOKENS_PER_SECOND.
+    Replies contain a fenced code block so code-block handling is exercised too, and
+    LOCAL_LLM_RATE_LIMIT simulates a provider that answers 429 under load.
+    """
+
+    def plan(self, text: str) -> Tuple[float, List[str]]:
+        rng = random.Random(f"{LOCAL_LLM_SEED}:{self.model}:{text}")
+        first_token = LOCAL_LLM_LATENCY_MS / 1000 * math.exp(rng.gauss(0, LOCAL_LLM_LATENCY_SIGMA))
+        words = [rng.choice(LOCAL_LLM_WORDS) for _ in range(max(LOCAL_LLM_REPLY_TOKENS, 12))]
+        third = len(words) // 3
+        code = " ".join(words[third:2 * third])
+        tokens = [w + " " for w in words[:third]]
+        tokens += ["\n```python\n", f"result = {code!r}\n", "print(result)\n", "```\n"]
+        tokens += [w + " " for w in words[2 * third:]]
+        return first_token, tokens
+
+    running = 0
+
+    @asynccontextmanager
+    async def rate_limited(self):
+        if LOCAL_LLM_RATE_LIMIT and LocalLlmSession.running >= LOCAL_LLM_RATE_LIMIT:
+            raise LocalRateLimitError("429 Too Many Requests")
+        LocalLlmSession.running += 1
+        try:
+            yield
+        finally:
+            LocalLlmSession.running -= 1
+
+    async def request(self, text: str) -> str:
+        first_token, tokens = self.plan(text)
+        delay = first_token
+        if LOCAL_LLM_TOKENS_PER_SECOND > 0:
+            delay += len(tokens) / LOCAL_LLM_TOKENS_PER_SECOND
+        async with self.rate_limited():
+            await asyncio.sleep(delay)
+        return "".join(tokens).strip()
+
+    async def request_stream(self, text: str):
+        async with self.rate_limited():
+            async for chunk in self.generate(text):
+                yield chunk
+
+    async def generate(self, text: str):
+        first_token, tokens = self.plan(text)
+        await asyncio.sleep(first_token)
+        # Group tokens so each chunk covers about 20ms of generation
+        per_chunk = max(1, int(LOCAL_LLM_TOKENS_PER_SECOND * 0.02)) if LOCAL_LLM_TOKENS_PER_SECOND > 0 else len(tokens)
+        text = "".join(tokens).strip()
+        offset = 0
+        for start in range(0, len(tokens), per_chunk):
+            if start and LOCAL_LLM_TOKENS_PER_SECOND > 0:
+                await asyncio.sleep(per_chunk / LOCAL_LLM_TOKENS_PER_SECOND)
+            size = len("".join(tokens[start:start + per_chunk]))
+            chunk = text[offset:offset + size] if start + per_chunk < len(tokens) else text[offset:]
+            offset += size
+            if chunk:
+                yield chunk
+
+# Providers with their own session class; any other provider name goes through LlmChat
+LLM_PROVIDERS = {
+    LOCAL_LLM_PROVIDER: LocalLlmSession,
+}
+
+def open_llm_session(provider: str, model: str, session_id: str, system_message: str) -> LlmSession:
+    session_class = LLM_PROVIDERS.get(provider, EmergentLlmSession)
+    return session_class(provider, model, session_id, system_message)
+
+# ==================== CONVERSATION MEMORY ====================
+
+# Messages resent verbatim with each turn; older ones are folded into a summary
+CONVERSATION_WINDOW_MESSAGES = int(os.environ.get('CONVERSATION_WINDOW_MESSAGES', '8'))
+CONVERSATION_MESSAGE_MAX_CHARS = int(os.environ.get('CONVERSATION_MESSAGE_MAX_CHARS', '2000'))
+CONVERSATION_SUMMARY_MAX_CHARS = int(os.environ.get('CONVERSATION_SUMMARY_MAX_CHARS', '2000'))
+CONVERSATION_MAX_SESSIONS = 1024
+CONVERSATION_GIST_CHARS = 160
+FENCED_CODE_PATTERN = re.compile(r"```(\w*)[^\n]*\n.*?(?:```|$)", re.DOTALL)
+SENTENCE_END_PATTERN = re.compile(r"(?<=[.!?])\s")
+
+def message_gist(content: str) -> str:
+    """First sentence of a message with code blocks reduced to a marker, for the summary."""
+    text = FENCED_CODE_PATTERN.sub(lambda m: f" [{m.group(1) or 'code'} block] ", content)
+    text = " ".join(text.split())
+    text = SENTENCE_END_PATTERN.split(text, 1)[0]
+    if len(text) > CONVERSATION_GIST_CHARS:
+        text = text[:CONVERSATION_GIST_CHARS - 3].rstrip() + "..."
+    return text
+
+class Conversation:
+    def __init__(self, summary: List[str], recent: List[Tuple[str, str]]):
+        self.summary = summary
+        self.recent = deque(recent)
+
+    def add(self, role: str, content: str) -> bool:
+        """Append a message; returns True when older messages were folded into the summary."""
+        self.recent.append((role, content))
+        folded = False
+        while len(self.recent) > CONVERSATION_WINDOW_MESSAGES:
+            old_role, old_content = self.recent.popleft()
+            self.summary.append(f"- {old_role.capitalize()}: {message_gist(old_content)}")
+            folded = True
+        # The summary keeps the most recent gists that fit
+        while self.summary and sum(len(line) + 1 for line in self.summary) > CONVERSATION_SUMMARY_MAX_CHARS:
+            self.summary.pop(0)
+        return folded
+
+    def render(self) -> str:
+        text = ""
+        if self.summary:
+            text += "\n\nSummary of the earlier conversation:\n" + "\n".join(self.summary)
+        if self.recent:
+            lines = []
+            for role, content in self.recent:
+                if len(content) > CONVERSATION_MESSAGE_MAX_CHARS:
+                    content = content[:CONVERSATION_MESSAGE_MAX_CHARS] + "\n[...]"
+                lines.append(f"{role.capitalize()}: {content}")
+            text += "\n\nRecent conversation:\n" + "\n\n".join(lines)
+        return text
+
+class ConversationMemory:
+    """
+    Bounds how much history each chat turn resends: the last
+    CONVERSATION_WINDOW_MESSAGES messages verbatim, plus an extractive summary of
+    everything before them that is extended one gist at a time as messages leave the
+    window. Summaries are stored in `chat_sessions`, so a session loaded after a
+    restart only needs its window read back from chat_history.
+    """
+
+    def __init__(self, max_sessions: int):
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._writes = set()
+
+    async def get(self, session_id: str) -> Conversation:
+        conversation = self._sessions.get(session_id)
+        if conversation:
+            self._sessions.move_to_end(session_id)
+            return conversation
+        
+        if chat_history_writer.has_pending(session_id):
+            await chat_history_writer.flush()
+        session = await db.chat_sessions.find_one({"_id": session_id}) or {}
+        messages = await db.chat_history.find(
+            {"session_id": session_id}, {"role": 1, "content": 1}
+        ).sort([("timestamp", -1), ("_id", -1)]).limit(CONVERSATION_WINDOW_MESSAGES).to_list(CONVERSATION_WINDOW_MESSAGES)
+        conversation = Conversation(
+            session.get("summary", []),
+            [(msg["role"], msg["content"]) for msg in reversed(messages)]
+        )
+        
+        self._sessions[session_id] = conversation
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return conversation
+
+    async def context(self, session_id: str) -> str:
+        return (await self.get(session_id)).render()
+
+    def record(self, session_id: str, user_content: str, assistant_content: str):
+        # Sessions not in memory are read back from chat_history when next used
+        conversation = self._sessions.get(session_id)
+        if not conversation:
+            return
+        folded = conversation.add("user", user_content)
+        folded = conversation.add("assistant", assistant_content) or folded
+        if folded:
+            # Off the response path, like the messages themselves
+            write = asyncio.create_task(self.save_summary(session_id, list(conversation.summary)))
+            self._writes.add(write)
+            write.add_done_callback(self._writes.discard)
+
+    async def save_summary(self, session_id: str, summary: List[str]):
+        try:
+            await db.chat_sessions.update_one(
+                {"_id": session_id},
+                {"$set": {"summary": summary, "updated_at": datetime.utcnow()}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Failed to save conversation summary: {str(e)}")
+
+conversations = ConversationMemory(CONVERSATION_MAX_SESSIONS)
+
+# ==================== AI CHAT ENDPOINTS ====================
+
+CHAT_SYSTEM_MESSAGE = "You are an expert programming assistant in a mobile IDE. Help users with code, debugging, explanations, and best practices. Be concise and practical."
+
+async def build_chat_system_message(request: ChatRequest) -> str:
+    system_message = CHAT_SYSTEM_MESSAGE
+    if request.context:
+        system_message += f"\n\nCurrent code context:\n{request.context}"
+    return system_message + await conversations.context(request.session_id)
+
+async def stream_chat_events(
+    chat: LlmSession,
+    message: str,
+    on_complete,
+    project_files: Optional[Dict[str, "ProjectFileRef"]] = None
+):
+    """
+    Drive a chat turn as Server-Sent Events: `token` events carry reply text as it
+    arrives, `code_block` events carry each fenced block as soon as it closes, and a
+    final `done` event carries whatever `on_complete(reply, code_blocks)` returns.
+    Given the project's files, a block naming a file is followed by an `operation`
+    event with the create or edit that applies it.
+    """
+    parts = []
+    parser = CodeFenceParser()
+    
+    def block_events(blocks: List[Dict[str, Any]]):
+        for block in blocks:
+            yield sse_event("code_block", block)
+            operation = suggest_operation(block, project_files) if project_files is not None else None
+            if operation:
+                yield sse_event("operation", operation.dict())
+    
+    try:
+        async for chunk in chat.stream(message):
+            parts.append(chunk)
+            yield sse_event("token", {"text": chunk})
+            for event in block_events(parser.feed(chunk)):
+                yield event
+        for event in block_events(parser.finish()):
+            yield event
+        
+        response = "".join(parts)
+        yield sse_event("done", await on_complete(response, parser.blocks))
+    except LlmBusy:
+        yield sse_event("error", {"detail": llm_busy_error().detail})
+    except Exception as e:
+        logger.error(f"Chat stream error: {str(e)}")
+        yield sse_event("error", {"detail": f"Chat error: {str(e)}"})
+
+CHAT_HISTORY_FLUSH_MS = int(os.environ.get('CHAT_HISTORY_FLUSH_MS', '200'))
+CHAT_HISTORY_MAX_PENDING = int(os.environ.get('CHAT_HISTORY_MAX_PENDING', '5000'))
+
+class ChatHistoryWriter:
+    """
+    Persists chat messages off the response path. Messages are queued and written
+    with one insert_many every flush interval. When the queue is full, or the writer
+    is not running, callers write inline instead, so a slow database slows chat down
+    rather than growing the queue without bound.
+    """
+
+    def __init__(self, interval: float, max_pending: int):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending: List[Dict[str, Any]] = []
+        # Messages the flush in progress is writing; flushes run one at a time
+        self._flushing: List[Dict[str, Any]] = []
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def add(self, documents: List[Dict[str, Any]]):
+        if not self._task or len(self._pending) + len(documents) > self.max_pending:
+            await db.chat_history.insert_many(documents)
+            return
+        self._pending.extend(documents)
+
+    def has_pending(self, session_id: str) -> bool:
+        """Whether messages of the session are not yet readable from MongoDB: queued, or being written."""
+        return any(doc["session_id"] == session_id for doc in itertools.chain(self._flushing, self._pending))
+
+    async def flush(self):
+        # Waits out a flush already in progress, so afterwards everything queued before the call is written
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, []
+            self._flushing = pending
+            try:
+                await db.chat_history.insert_many(pending, ordered=False)
+                return
+            except BulkWriteError as e:
+                # Duplicates are messages a previous, partly failed flush already wrote
+                failed = {
+                    error["index"] for error in e.details.get("writeErrors", [])
+                    if error.get("code") != DUPLICATE_KEY_ERROR
+                }
+                retry = [doc for index, doc in enumerate(pending) if index in failed]
+            except Exception as e:
+                logger.error(f"Failed to flush chat history: {str(e)}")
+                retry = pending
+            finally:
+                self._flushing = []
+            if retry:
+                room = self.max_pending - len(self._pending)
+                if room < len(retry):
+                    logger.error(f"Dropping {len(retry) - max(room, 0)} chat messages, history queue is full")
+                self._pending[:0] = retry[:max(room, 0)]
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+chat_history_writer = ChatHistoryWriter(CHAT_HISTORY_FLUSH_MS / 1000, CHAT_HISTORY_MAX_PENDING)
+
+async def save_chat_turn(
+    session_id: str,
+    user_content: str,
+    assistant_content: str,
+    extra: Optional[Dict[str, Any]] = None,
+    assistant_extra: Optional[Dict[str, Any]] = None
+):
+    conversations.record(session_id, user_content, assistant_content)
+    now = datetime.utcnow()
+    # Both messages share a timestamp; insertion order (_id) keeps the user's first
+    await chat_history_writer.add([
+        {
+            "session_id": session_id,
+            **(extra or {}),
+            "role": "user",
+            "content": user_content,
+            "timestamp": now
+        },
+        {
+            "session_id": session_id,
+            **(extra or {}),
+            "role": "assistant",
+            "content": assistant_content,
+            **(assistant_extra or {}),
+            "timestamp": now
+        }
+    ])
+
+def sse_response(events) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.post("/chat", response_model=ChatResponse)
+async def chat_with_ai(request: ChatRequest):
+    try:
+        # Initialize chat
+        chat = open_llm_session(
+            request.provider, request.model,
+            session_id=request.session_id,
+            system_message=await build_chat_system_message(request)
+        )
+        
+        # Get response
+        response = await chat.send(request.message)
+        
+        # Store chat history
+        await save_chat_turn(request.session_id, request.message, response)
+        
+        return ChatResponse(response=response, session_id=request.session_id)
+    
+    except LlmBusy:
+        raise llm_busy_error()
+    except Exception as e:
+        logger.error(f"Chat error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
+
+@api_router.post("/chat/stream")
+async def chat_with_ai_stream(request: ChatRequest):
+    """
+    Streaming variant of /chat, as Server-Sent Events (`token`, `code_block`, `done`).
+    The exchange is saved to chat history once the reply is complete.
+    """
+    if llm_limiter.full(request.provider, request.model):
+        raise llm_busy_error()
+    chat = open_llm_session(
+        request.provider, request.model,
+        session_id=request.session_id,
+        system_message=await build_chat_system_message(request)
+    )
+    
+    async def on_complete(response: str, code_blocks: List[Dict[str, Any]]):
+        await save_chat_turn(request.session_id, request.message, response)
+        return ChatResponse(response=response, session_id=request.session_id).dict()
+    
+    return sse_response(stream_chat_events(chat, request.message, on_complete))
+
+@api_router.get("/chat/history/{session_id}", response_model=List[ChatMessage])
+async def get_chat_history(
+    session_id: str,
+    response: Response,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None
+):
+    """
+    Most recent messages of a session, oldest first.
+    Pass X-Next-Cursor back as `cursor` to page further into the past.
+    """
+    # Read your own writes: messages still queued for this session go out first
+    if chat_history_writer.has_pending(session_id):
+        await chat_history_writer.flush()
+    
+    query = {"session_id": session_id}
+    if cursor:
+        timestamp, last_id = decode_cursor(cursor, is_datetime=True)
+        if not ObjectId.is_valid(last_id):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query.update(after_cursor("timestamp", -1, timestamp, ObjectId(last_id)))
+    messages = await db.chat_history.find(query).sort(
+        [("timestamp", -1), ("_id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    messages = set_next_cursor(response, messages, limit, "timestamp")
+    
+    return [ChatMessage(**msg) for msg in reversed(messages)]
+
+# ==================== PROJECT CONTEXT BUILDER ====================
+
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '6000'))
+CONTEXT_CHUNK_LINES = 40
+
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_$][A-Za-z0-9_$]*")
+CAMEL_CASE_PATTERN = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+SYMBOL_PATTERN = re.compile(
+    r"^\s*(?:export\s+)?(?:default\s+)?(?:public\s+|private\s+|protected\s+|static\s+)*(?:async\s+)?"
+    r"(?:def|class|function|interface|type|enum|const|let|var)\s+([A-Za-z_$][\w$]*)",
+    re.MULTILINE
+)
+IMPORT_PATTERN = re.compile(
+    r"""^\s*(?:from\s+([\w.]+)\s+import|import\s+([\w.]+)\s*$|import\s.*?from\s+['"]([^'"]+)['"]"""
+    r"""|.*?require(?:_once)?\s*\(?\s*['"]([^'"]+)['"]|include(?:_once)?\s*\(?\s*['"]([^'"]+)['"])""",
+    re.MULTILINE
+)
+
+# Weight of a term by where it appears in a chunk
+PATH_TERM_WEIGHT = 3
+SYMBOL_TERM_WEIGHT = 2
+IMPORTED_FILE_BOOST = 2.0
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for code and English
+    return len(text) // 4 + 1
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased identifier terms, with camelCase and snake_case names also split into their parts."""
+    terms = []
+    for identifier in IDENTIFIER_PATTERN.findall(text):
+        lowered = identifier.lower()
+        terms.append(lowered)
+        parts = [p.lower() for piece in identifier.split("_") for p in CAMEL_CASE_PATTERN.findall(piece)]
+        if len(parts) > 1:
+            terms.extend(parts)
+    return terms
+
+def file_stem(path: str) -> str:
+    name = path.replace("\\", "/").rstrip("/").rsplit("/", 1)[-1]
+    return name.split(".", 1)[0].lower()
+
+def imported_stems(content: str) -> set:
+    """Module names a file imports, reduced to the file stems they most likely refer to."""
+    stems = set()
+    for match in IMPORT_PATTERN.finditer(content):
+        module = next(group for group in match.groups() if group)
+        stems.add(file_stem(module.replace(".", "/") if "/" not in module else module))
+    return stems
+
+class ContextChunk:
+    """A slice of one file, with the weighted term counts used for ranking."""
+
+    def __init__(self, file_id: str, path: str, language: str, start_line: int, end_line: int, text: str):
+        self.file_id = file_id
+        self.path = path
+        self.language = language
+        self.start_line = start_line
+        self.end_line = end_line
+        self.text = text
+        self.symbols = SYMBOL_PATTERN.findall(text)
+        self.terms = Counter(tokenize(text))
+        for term in tokenize(path):
+            self.terms[term] += PATH_TERM_WEIGHT
+        for term in tokenize(" ".join(self.symbols)):
+            self.terms[term] += SYMBOL_TERM_WEIGHT
+        self.length = sum(self.terms.values())
+        self.tokens = estimate_tokens(text)
+
+    def render(self) -> str:
+        return f"\n--- {self.path} (lines {self.start_line}-{self.end_line}) ---\n{self.text}"
+
+def chunk_file(file_doc: Dict[str, Any]) -> List[ContextChunk]:
+    lines = file_doc.get("content", "").split("\n")
+    chunks = []
+    for start in range(0, len(lines), CONTEXT_CHUNK_LINES):
+        text = "\n".join(lines[start:start + CONTEXT_CHUNK_LINES])
+        if text.strip():
+            chunks.append(ContextChunk(
+                file_doc["_id"], file_doc["path"], file_doc.get("language", "text"),
+                start + 1, min(start + CONTEXT_CHUNK_LINES, len(lines)), text
+            ))
+    return chunks
+
+def pack_context_base(
+    project: Optional[Dict[str, Any]],
+    current_file: Optional[Dict[str, Any]],
+    paths: List[str],
+    budget_tokens: int
+) -> Tuple[str, int]:
+    """
+    The part of the context that doesn't depend on the message: project header, the
+    file being edited (up to half the budget) and a list of all paths.
+    Returns the text and the token budget left for relevant chunks.
+    """
+    parts = []
+    if project:
+        parts.append(f"Project: {project['name']}")
+        if project.get('description'):
+            parts.append(f"Description: {project['description']}")
+    remaining = budget_tokens - sum(estimate_tokens(p) for p in parts)
+    
+    if current_file:
+        content = current_file.get("content", "")
+        # The content may already be just the file's head; `length` is the full size
+        length = current_file.get("length") or len(content)
+        limit = max(remaining // 2, 0) * 4
+        if len(content) > limit or length > len(content):
+            content = content[:limit] + f"\n... (truncated, {length} chars total)"
+        section = f"\n=== Currently Editing: {current_file['name']} ===\n{content}"
+        parts.append(section)
+        remaining -= estimate_tokens(section)
+    
+    if paths:
+        listing = "\n=== Project Files ===\n" + "\n".join(paths)
+        if estimate_tokens(listing) <= remaining // 4:
+            parts.append(listing)
+            remaining -= estimate_tokens(listing)
+    
+    return "\n".join(parts), remaining
+
+def pack_chunks(ranked: List[ContextChunk], remaining: int) -> str:
+    """The best-ranked chunks that fit in the remaining budget."""
+    selected = []
+    for chunk in ranked:
+        if chunk.tokens <= remaining:
+            selected.append(chunk)
+            remaining -= chunk.tokens
+        if remaining <= 0:
+            break
+    if not selected:
+        return ""
+    return "\n\n=== Relevant Code ===\n" + "\n".join(chunk.render() for chunk in selected)
+
+# ==================== PROJECT INDEX ====================
+
+PROJECT_INDEX_MAX_PROJECTS = int(os.environ.get('PROJECT_INDEX_MAX_PROJECTS', '64'))
+# Memory bound, in characters of indexed text, across all project indexes
+PROJECT_INDEX_MAX_CHARS = int(os.environ.get('PROJECT_INDEX_MAX_CHARS', str(32 * 1024 * 1024)))
+# Start of each file kept for when it is the file being edited: half the default budget
+PROJECT_INDEX_HEAD_CHARS = CONTEXT_TOKEN_BUDGET * 2
+# Larger files are listed but not chunked; they are rarely useful as prompt context
+PROJECT_INDEX_MAX_FILE_BYTES = 512 * 1024
+
+# Process-wide counter, so a project index rebuilt after eviction never reuses a version
+project_content_versions = itertools.count(1)
+
+class IndexedFile:
+    """
+    What the index keeps of a file. The full content is not kept: only its chunks,
+    the stems it imports and its head, which is all the context builder needs.
+    """
+
+    def __init__(self, file_doc: Dict[str, Any]):
+        content = file_doc.get("content") or ""
+        self.id = file_doc["_id"]
+        self.name = file_doc["name"]
+        self.path = file_doc["path"]
+        self.language = file_doc.get("language", "text")
+        self.hash = file_doc.get("hash") or hashlib.sha256(content.encode()).hexdigest()
+        self.version = file_doc.get("version") or 0
+        self.length = file_doc.get("length") or len(content)
+        self.imports = imported_stems(content)
+        self.head = content[:PROJECT_INDEX_HEAD_CHARS]
+        # Large files kept in content chunks are listed but not indexed
+        self.stored_chunks = file_doc.get("chunks")
+        if not self.stored_chunks and len(content) <= PROJECT_INDEX_MAX_FILE_BYTES:
+            self.chunks = chunk_file(file_doc)
+        else:
+            self.chunks = []
+        self.chars = len(self.head) + sum(len(chunk.text) for chunk in self.chunks)
+
+    async def load_head(self, chars: int) -> str:
+        """The first `chars` characters, read back from MongoDB only when more than the kept head is wanted."""
+        if len(self.head) >= min(chars, self.length):
+            return self.head[:chars]
+        file_doc = await db.files.find_one({"_id": self.id}, {"content": 1, "chunks": 1})
+        return await load_content(file_doc, 0, chars) if file_doc else self.head[:chars]
+
+class ProjectIndex:
+    """
+    In-memory retrieval index for one project: each file's chunks plus an inverted
+    index from term to the chunks containing it. Kept current by the file endpoints,
+    so answering a query never re-reads or re-chunks the project.
+    """
+
+    def __init__(self):
+        self.files: Dict[str, IndexedFile] = {}
+        self.postings: Dict[str, set] = {}
+        self.total_length = 0
+        self.chunk_count = 0
+        self.chars = 0
+        self.version = next(project_content_versions)
+
+    def upsert(self, file_doc: Dict[str, Any]):
+        existing = self.files.get(file_doc["_id"])
+        if existing:
+            if (file_doc.get("version") or 0) < existing.version:
+                return
+            # Unchanged content and path: nothing to re-process
+            if existing.hash == file_doc.get("hash") and existing.path == file_doc["path"]:
+                if existing.name != file_doc["name"]:
+                    existing.name = file_doc["name"]
+                    self.version = next(project_content_versions)
+                existing.version = file_doc.get("version") or 0
+                return
+            self.remove(existing.id)
+        self.version = next(project_content_versions)
+        entry = IndexedFile(file_doc)
+        self.files[entry.id] = entry
+        self.chars += entry.chars
+        for chunk in entry.chunks:
+            for term in chunk.terms:
+                self.postings.setdefault(term, set()).add(chunk)
+            self.total_length += chunk.length
+            self.chunk_count += 1
+
+    def remove(self, file_id: str):
+        entry = self.files.pop(file_id, None)
+        if not entry:
+            return
+        self.version = next(project_content_versions)
+        self.chars -= entry.chars
+        for chunk in entry.chunks:
+            for term in chunk.terms:
+                postings = self.postings.get(term)
+                if postings:
+                    postings.discard(chunk)
+                    if not postings:
+                        del self.postings[term]
+            self.total_length -= chunk.length
+            self.chunk_count -= 1
+
+    def paths(self) -> List[str]:
+        return sorted(entry.path for entry in self.files.values())
+
+    def search(self, query: str, boosted_stems: set, exclude_file_id: Optional[str] = None) -> List[ContextChunk]:
+        """Relevant chunks by BM25 score against the query, favouring files the current file imports."""
+        if not self.chunk_count:
+            return []
+        query_terms = set(tokenize(query)) & self.postings.keys()
+        average_length = self.total_length / self.chunk_count
+        scores: Dict[ContextChunk, float] = {}
+        
+        for term in query_terms:
+            postings = self.postings[term]
+            idf = math.log(1 + (self.chunk_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk in postings:
+                frequency = chunk.terms[term]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * chunk.length / average_length)
+                scores[chunk] = scores.get(chunk, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        
+        for entry in self.files.values():
+            if file_stem(entry.path) in boosted_stems:
+                for chunk in entry.chunks:
+                    scores[chunk] = (scores.get(chunk, 0.0) + 1) * IMPORTED_FILE_BOOST
+        
+        ranked = [
+            (-score, chunk.path, chunk.start_line, chunk)
+            for chunk, score in scores.items()
+            if chunk.file_id != exclude_file_id
+        ]
+        ranked.sort(key=lambda item: item[:3])
+        return [item[3] for item in ranked]
+
+class ProjectIndexRegistry:
+    """
+    Indexes for recently used projects, built from MongoDB on first use and evicted
+    least-recently-used, bounded both by project count and by the characters of text
+    held. File changes that land while an index is being built are replayed onto it
+    once the build finishes.
+    """
+
+    def __init__(self, max_projects: int, max_chars: int):
+        self.max_projects = max_projects
+        self.max_chars = max_chars
+        self._indexes: "OrderedDict[str, ProjectIndex]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}
+        self._pending_changes: Dict[str, List[tuple]] = {}
+
+    def loaded(self, project_id: str) -> bool:
+        return project_id in self._indexes
+
+    async def get(self, project_id: str) -> ProjectIndex:
+        if project_id in self._indexes:
+            self._indexes.move_to_end(project_id)
+            return self._indexes[project_id]
+        if project_id in self._loading:
+            loading = self._loading[project_id]
+            try:
+                return await asyncio.shield(loading)
+            except asyncio.CancelledError:
+                if not loading.cancelled():
+                    raise
+                # The request building the index was cancelled, not this one: build it here
+                return await self.get(project_id)
+        
+        loading = asyncio.get_running_loop().create_future()
+        self._loading[project_id] = loading
+        self._pending_changes[project_id] = []
+        try:
+            index = ProjectIndex()
+            cursor = db.files.find(
+                {"project_id": project_id},
+                {"name": 1, "path": 1, "language": 1, "content": 1, "chunks": 1, "length": 1, "hash": 1, "version": 1}
+            )
+            async for file_doc in cursor:
+                index.upsert(file_doc)
+            for change in self._pending_changes[project_id]:
+                self._apply(index, *change)
+            self._indexes[project_id] = index
+            self._evict()
+            loading.set_result(index)
+            return index
+        except asyncio.CancelledError:
+            loading.cancel()
+            raise
+        except BaseException as e:
+            loading.set_exception(e)
+            # Nobody else may be waiting; don't leave an unretrieved exception behind
+            loading.exception()
+            raise
+        finally:
+            del self._loading[project_id]
+            del self._pending_changes[project_id]
+
+    @property
+    def chars(self) -> int:
+        return sum(index.chars for index in self._indexes.values())
+
+    def _evict(self):
+        # The most recently used index stays even if it alone is over the bound
+        while len(self._indexes) > 1 and (len(self._indexes) > self.max_projects or self.chars > self.max_chars):
+            self._indexes.popitem(last=False)
+
+    def _apply(self, index: ProjectIndex, action: str, payload: Any):
+        if action == "upsert":
+            index.upsert(payload)
+        else:
+            index.remove(payload)
+
+    def _record(self, project_id: str, action: str, payload: Any):
+        if project_id in self._indexes:
+            self._apply(self._indexes[project_id], action, payload)
+            if action == "upsert":
+                self._evict()
+        elif project_id in self._pending_changes:
+            self._pending_changes[project_id].append((action, payload))
+
+    def file_saved(self, file_doc: Dict[str, Any]):
+        self._record(file_doc["project_id"], "upsert", file_doc)
+
+    def file_deleted(self, project_id: str, file_id: str):
+        self._record(project_id, "remove", file_id)
+
+    def project_deleted(self, project_id: str):
+        self._indexes.pop(project_id, None)
+
+project_indexes = ProjectIndexRegistry(PROJECT_INDEX_MAX_PROJECTS, PROJECT_INDEX_MAX_CHARS)
+
+CONTEXT_CACHE_MAX_CHARS = int(os.environ.get('CONTEXT_CACHE_MAX_CHARS', str(8 * 1024 * 1024)))
+
+class ContextCache:
+    """LRU cache of assembled context bases, bounded by the total characters held."""
+
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+        self.chars = 0
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+    def get(self, key: tuple) -> Optional[tuple]:
+        entry = self._entries.get(key)
+        if entry:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: tuple, value: tuple):
+        if key in self._entries:
+            self.chars -= len(self._entries.pop(key)[0])
+        self._entries[key] = value
+        self.chars += len(value[0])
+        while self.chars > self.max_chars and self._entries:
+            self.chars -= len(self._entries.popitem(last=False)[1][0])
+
+context_cache = ContextCache(CONTEXT_CACHE_MAX_CHARS)
+
+async def build_project_context(
+    project_id: str,
+    query: str,
+    current_file_id: Optional[str] = None,
+    budget_tokens: int = CONTEXT_TOKEN_BUDGET,
+    include_files: bool = True
+) -> str:
+    """
+    Context for an AI request about a project: the parts of the project most relevant
+    to `query` and to what the current file imports, packed into `budget_tokens`.
+    Used by chat; code completion could reuse it with a smaller budget.
+    """
+    if not include_files:
+        project = await db.projects.find_one({"_id": project_id}, {"name": 1, "description": 1})
+        current_file = None
+        if current_file_id:
+            current_file = await db.files.find_one({"_id": current_file_id}, {"name": 1, "content": 1, "chunks": 1, "length": 1})
+            if current_file and current_file.get("chunks"):
+                current_file["content"] = await load_content(current_file, 0, budget_tokens * 4)
+        return pack_context_base(project, current_file, [], budget_tokens)[0]
+    
+    index = await project_indexes.get(project_id)
+    entry = index.files.get(current_file_id) if current_file_id else None
+    
+    # Everything but the ranked chunks only changes when project content does
+    cache_key = (project_id, index.version, current_file_id, entry.version if entry else None, budget_tokens)
+    cached = context_cache.get(cache_key)
+    if not cached:
+        project = await db.projects.find_one({"_id": project_id}, {"name": 1, "description": 1})
+        current_file = None
+        if entry:
+            # Only the head of the file can fit in the budget anyway: at most half of it
+            current_file = {"name": entry.name, "content": await entry.load_head(budget_tokens * 2), "length": entry.length}
+        base, remaining = pack_context_base(project, current_file, index.paths(), budget_tokens)
+        boosted = entry.imports if entry else set()
+        cached = (base, remaining, boosted)
+        context_cache.put(cache_key, cached)
+    
+    base, remaining, boosted = cached
+    ranked = index.search(query, boosted, exclude_file_id=current_file_id)
+    return base + pack_chunks(ranked, remaining)
+
+# ==================== ENHANCED AI CHAT (CURSOR-LIKE) ====================
+
+ENHANCED_SYSTEM_MESSAGE = """You are an expert AI coding assistant integrated into a mobile IDE (like Cursor AI).
+
+Your capabilities:
+1. **Code Generation**: Generate complete, working code for any language
+2. **File Creation**: Suggest creating new files when needed
+3. **Code Refactoring**: Improve existing code while maintaining functionality
+4. **Multi-file Operations**: Work across multiple files in a project
+5. **Explanations**: Explain code concepts clearly
+
+When suggesting code:
+- Use proper markdown code blocks with language tags (```python, ```javascript, etc.)
+- Be concise but complete
+- Include comments for complex logic
+- Follow best practices
+
+When creating/editing files:
+- Suggest the complete file content
+- Use descriptive file names
+- Include the file extension
+- Put the file path after the language tag, e.g. ```python src/app.py
+
+Format your responses to be clear and actionable."""
+
+FILE_PATH_PATTERN = r"(?:\.?/)?(?:[\w-][\w.-]*/)*[\w-][\w.-]*\.[A-Za-z][A-Za-z0-9]{0,7}"
+FENCE_OPEN_PATTERN = re.compile(r"^ {0,3}(`{3,}|~{3,})\s*([^\s`]*)\s*(.*?)\s*$")
+FENCE_PATH_ATTRIBUTE_PATTERN = re.compile(r"(?:title|file|filename|path)\s*=\s*[\"']?(" + FILE_PATH_PATTERN + ")")
+# A comment holding just a path, as the first line of a block: "# app.py", "// file: src/index.js"
+COMMENT_PATH_PATTERN = re.compile(
+    r"^\s*(?:#|//|--|/\*|<!--)\s*(?:(?:file(?:name)?|path)\s*:\s*)?(" + FILE_PATH_PATTERN + r")\s*(?:\*/|-->)?\s*$",
+    re.IGNORECASE
+)
+# Paths named on the line introducing a block: in backticks or bold, as a heading, or after "File:"
+PROSE_PATH_PATTERN = re.compile(
+    r"[`*]+(" + FILE_PATH_PATTERN + r")[`*]+|^#+\s*(" + FILE_PATH_PATTERN + r")\s*$|\bfile(?:name)?\s*:\s*(" + FILE_PATH_PATTERN + ")",
+    re.IGNORECASE
+)
+EXTENSION_LANGUAGES = {
+    "py": "python", "js": "javascript", "jsx": "javascript", "mjs": "javascript",
+    "ts": "typescript", "tsx": "typescript", "php": "php", "html": "html", "htm": "html",
+    "css": "css", "json": "json", "md": "markdown", "sh": "bash",
+}
+
+def language_for_path(path: str) -> str:
+    extension = path.rsplit(".", 1)[-1].lower()
+    return EXTENSION_LANGUAGES.get(extension, "text")
+
+def normalize_file_path(path: str) -> str:
+    return re.sub(r"^\.?/+", "", path)
+
+class CodeFenceParser:
+    """
+    Incremental parser for fenced code blocks in a model reply. Text is fed in
+    chunks as it streams in and each block is returned as soon as its closing fence
+    arrives; `finish` returns a block left open when the reply ended, marked
+    incomplete. A block carries a file path when the reply names one: in the fence
+    info string (```python src/app.py), as a comment on its first line (# app.py),
+    or on the prose line introducing it.
+    """
+
+    def __init__(self):
+        self.blocks: List[Dict[str, Any]] = []
+        self._partial = ""
+        self._fence: Optional[Tuple[str, int]] = None
+        self._info = ("", "")
+        self._lines: List[str] = []
+        self._prose = ""
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        *lines, self._partial = (self._partial + text).split("\n")
+        closed = [self._line(line) for line in lines]
+        return [block for block in closed if block]
+
+    def finish(self) -> List[Dict[str, Any]]:
+        closed = []
+        if self._partial:
+            block = self._line(self._partial)
+            self._partial = ""
+            if block:
+                closed.append(block)
+        if self._fence:
+            closed.append(self._close(complete=False))
+        return closed
+
+    def _line(self, line: str) -> Optional[Dict[str, Any]]:
+        if not self._fence:
+            match = FENCE_OPEN_PATTERN.match(line)
+            if match:
+                self._fence = (match.group(1)[0], len(match.group(1)))
+                self._info = (match.group(2), match.group(3))
+                self._lines = []
+            elif line.strip():
+                self._prose = line.strip()
+            return None
+        
+        char, length = self._fence
+        closing = line.strip()
+        if len(closing) >= length and closing == char * len(closing):
+            return self._close(complete=True)
+        self._lines.append(line)
+        return None
+
+    def _close(self, complete: bool) -> Dict[str, Any]:
+        tag, attributes = self._info
+        if "=" in tag:
+            # No language, only attributes: ```title="app.py"
+            tag, attributes = "", f"{tag} {attributes}"
+        language, _, path = tag.partition(":")
+        if not path and re.fullmatch(FILE_PATH_PATTERN, language):
+            language, path = "", language
+        if not path:
+            match = FENCE_PATH_ATTRIBUTE_PATTERN.search(attributes)
+            if match:
+                path = match.group(1)
+            elif re.fullmatch(FILE_PATH_PATTERN, attributes):
+                path = attributes
+        if not path:
+            first_line = next((line for line in self._lines if line.strip()), "")
+            match = COMMENT_PATH_PATTERN.match(first_line)
+            if match:
+                path = match.group(1)
+        if not path:
+            match = PROSE_PATH_PATTERN.search(self._prose)
+            if match:
+                path = next(group for group in match.groups() if group)
+        
+        block = {
+            'language': language or (language_for_path(path) if path else 'text'),
+            'code': "\n".join(self._lines).strip("\n"),
+            # A block cut off by the end of the reply is shown but never applied
+            'can_apply': complete,
+            'complete': complete,
+            'file_path': path or None,
+            'description': self._prose,
+        }
+        self.blocks.append(block)
+        self._fence = None
+        self._prose = ""
+        return block
+
+def extract_code_blocks(text: str) -> List[Dict[str, Any]]:
+    parser = CodeFenceParser()
+    parser.feed(text)
+    parser.finish()
+    return parser.blocks
+
+class ProjectFileRef:
+    """A project file's id and path, all that suggesting operations needs."""
+
+    def __init__(self, file_id: str, path: str):
+        self.id = file_id
+        self.path = path
+
+async def project_files_by_path(project_id: str, use_index: bool = True) -> Dict[str, ProjectFileRef]:
+    """
+    The project's files by normalized path. Without `use_index`, unless the project is
+    indexed already, only paths are read instead of building the index from every file.
+    """
+    if use_index or project_indexes.loaded(project_id):
+        index = await project_indexes.get(project_id)
+        files = [(entry.id, entry.path) for entry in index.files.values()]
+    else:
+        cursor = db.files.find({"project_id": project_id}, {"path": 1})
+        files = [(file_doc["_id"], file_doc["path"]) async for file_doc in cursor]
+    return {normalize_file_path(path): ProjectFileRef(file_id, path) for file_id, path in files}
+
+def suggest_operation(block: Dict[str, Any], project_files: Dict[str, ProjectFileRef]) -> Optional[AIFileOperation]:
+    """A create or edit for a complete block that names a file; edits when the project already has it."""
+    if not block['file_path'] or not block['complete']:
+        return None
+    relative_path = normalize_file_path(block['file_path'])
+    existing = project_files.get(relative_path)
+    operation = 'edit' if existing else 'create'
+    language = block['language']
+    return AIFileOperation(
+        operation=operation,
+        file_id=existing.id if existing else None,
+        file_name=posixpath.basename(relative_path),
+        file_path=existing.path if existing else f"/{relative_path}",
+        content=block['code'],
+        language=EXTENSION_LANGUAGES.get(language.lower(), language) if language != 'text' else language_for_path(relative_path),
+        description=re.sub(r"[*`#]+", "", block['description']).strip() or f"{operation.capitalize()} {relative_path}"
+    )
+
+def suggest_operations(code_blocks: List[Dict[str, Any]], project_files: Dict[str, ProjectFileRef]) -> List[AIFileOperation]:
+    operations = [suggest_operation(block, project_files) for block in code_blocks]
+    return [operation for operation in operations if operation]
+
+async def build_enhanced_system_message(request: EnhancedChatRequest) -> str:
+    full_context = await build_project_context(
+        request.project_id,
+        request.message,
+        current_file_id=request.current_file_id,
+        include_files=request.include_project_context
+    )
+    
+    system_message = ENHANCED_SYSTEM_MESSAGE
+    if full_context:
+        system_message += f"\n\nCurrent project context:\n{full_context}"
+    return system_message + await conversations.context(request.session_id)
+
+@api_router.post("/chat/enhanced", response_model=EnhancedChatResponse)
+async def enhanced_chat(request: EnhancedChatRequest):
+    """
+    Enhanced AI chat with full project context and code generation capabilities.
+    Similar to Cursor AI - can generate, refactor, and create files.
+    """
+    try:
+        # Initialize chat
+        chat = open_llm_session(
+            request.provider, request.model,
+            session_id=request.session_id,
+            system_message=await build_enhanced_system_message(request)
+        )
+        
+        # Get response
+        response = await chat.send(request.message)
+        
+        # Parse response for code blocks and suggested operations
+        code_blocks = extract_code_blocks(response)
+        suggested_operations = suggest_operations(
+            code_blocks, await project_files_by_path(request.project_id, request.include_project_context)
+        )
+        
+        # Store chat history
+        await save_chat_turn(
+            request.session_id, request.message, response,
+            extra={"project_id": request.project_id},
+            assistant_extra={"code_blocks": code_blocks}
+        )
+        
+        return EnhancedChatResponse(
+            response=response,
+            session_id=request.session_id,
+            suggested_operations=suggested_operations,
+            code_blocks=code_blocks
+        )
+    
+    except LlmBusy:
+        raise llm_busy_error()
+    except Exception as e:
+        logger.error(f"Enhanced chat error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
+
+@api_router.post("/chat/enhanced/stream")
+async def enhanced_chat_stream(request: EnhancedChatRequest):
+    """
+    Streaming variant of /chat/enhanced, as Server-Sent Events (`token`, `code_block`,
+    `operation`, `done`). The `done` event carries the same payload as the
+    non-streaming response.
+    """
+    if llm_limiter.full(request.provider, request.model):
+        raise llm_busy_error()
+    chat = open_llm_session(
+        request.provider, request.model,
+        session_id=request.session_id,
+        system_message=await build_enhanced_system_message(request)
+    )
+    project_files = await project_files_by_path(request.project_id, request.include_project_context)
+    
+    async def on_complete(response: str, code_blocks: List[Dict[str, Any]]):
+        await save_chat_turn(
+            request.session_id, request.message, response,
+            extra={"project_id": request.project_id},
+            assistant_extra={"code_blocks": code_blocks}
+        )
+        return EnhancedChatResponse(
+            response=response,
+            session_id=request.session_id,
+            suggested_operations=suggest_operations(code_blocks, project_files),
+            code_blocks=code_blocks
+        ).dict()
+    
+    return sse_response(stream_chat_events(chat, request.message, on_complete, project_files))
+
+@api_router.post("/ai/apply-operation")
+async def apply_ai_operation(request: ApplyAIOperationRequest):
+    """
+    Apply AI-suggested operations: create new file, edit existing file, or refactor code.
+    """
+    try:
+        now = datetime.utcnow()
+        
+        if request.operation == 'create':
+            # Create new file
+            file_doc = {
+                "_id": str(ObjectId()),
+                "project_id": request.project_id,
+                "name": request.file_name,
+                "path": request.file_path,
+                **(await content_fields(request.content)),
+                "language": request.language,
+                "version": 1,
+                "created_at": now,
+                "updated_at": now
+            }
+            await db.files.insert_one(file_doc)
+            
+            # Update project timestamp
+            project_touch_writer.touch(request.project_id, now)
+            project_indexes.file_saved(file_doc)
+            
+            return {
+                "success": True,
+                "message": "File created successfully",
+                "file_id": file_doc["_id"],
+                "operation": "create"
+            }
         
         elif request.operation in ['edit', 'refactor']:
             # Update existing file
             if not request.file_id:
                 raise HTTPException(status_code=400, detail="file_id required for edit/refactor operations")
             
-            result = await db.files.update_one(
+            file_doc = await db.files.find_one_and_update(
                 {"_id": request.file_id},
                 {"$set": {
-                    "content": request.content,
+                    **(await content_fields(request.content)),
                     "updated_at": now
-                }}
+                }, "$inc": {"version": 1}},
+                return_document=ReturnDocument.AFTER
             )
             
-            if result.matched_count == 0:
+            if not file_doc:
                 raise HTTPException(status_code=404, detail="File not found")
             
             # Update project timestamp
-            await db.projects.update_one(
-                {"_id": request.project_id},
-                {"$set": {"updated_at": now}}
-            )
+            project_touch_writer.touch(request.project_id, now)
+            project_indexes.file_saved(file_doc)
             
             return {
                 "success": True,
@@ -528,162 +2540,1044 @@ async def apply_ai_operation(request: ApplyAIOperationRequest):
         logger.error(f"Apply AI operation error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Operation failed: {str(e)}")
 
+AI_BATCH_MAX_OPERATIONS = 200
+transaction_support: Optional[bool] = None
+
+async def transactions_supported() -> bool:
+    """Transactions need a replica set or a sharded cluster; checked once per process."""
+    global transaction_support
+    if transaction_support is None:
+        try:
+            hello = await client.admin.command("hello")
+            transaction_support = "setName" in hello or hello.get("msg") == "isdbgrid"
+        except Exception as e:
+            logger.warning(f"Could not detect transaction support: {str(e)}")
+            transaction_support = False
+    return transaction_support
+
+class BatchRolledBack(Exception):
+    """Aborts a transactional batch; carries the error for each failed request index."""
+    
+    def __init__(self, errors: Dict[int, str]):
+        super().__init__(errors)
+        self.errors = errors
+
+def rolled_back_response(results: List[AIOperationResult], errors: Dict[int, str], created: Dict[int, Any]) -> ApplyAIOperationsResponse:
+    for i, result in enumerate(results):
+        result.success = False
+        result.error = errors.get(i, "Not applied, batch rolled back")
+        if i in created:
+            result.file_id = None
+    return ApplyAIOperationsResponse(applied=0, transactional=True, results=results)
+
+async def write_file_batch(writes: List[Any], edited_ids: List[str], project_id: str, session=None):
+    """
+    Run the batch's writes in one bulk_write and read back the edited files.
+    Returns (error message by write position, edited file docs). Inside a
+    transaction a failed write raises, so the whole batch rolls back.
+    """
+    errors = {}
+    try:
+        await db.files.bulk_write(writes, ordered=session is not None, session=session)
+    except BulkWriteError as e:
+        if session:
+            raise
+        errors = {error["index"]: error["errmsg"] for error in e.details.get("writeErrors", [])}
+    edited = []
+    if edited_ids:
+        edited = await db.files.find(
+            {"_id": {"$in": edited_ids}, "project_id": project_id}, session=session
+        ).to_list(None)
+    return errors, edited
+
+@api_router.post("/ai/apply-operations", response_model=ApplyAIOperationsResponse)
+async def apply_ai_operations(request: ApplyAIOperationsRequest):
+    """
+    Apply a batch of AI-suggested operations (as returned in suggested_operations) in
+    one request and one bulk write, inside a transaction when the deployment supports
+    them. Results are reported per operation, in request order.
+    """
+    if len(request.operations) > AI_BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {AI_BATCH_MAX_OPERATIONS} operations per batch")
+    
+    now = datetime.utcnow()
+    results = [
+        AIOperationResult(index=i, operation=operation.operation, success=False)
+        for i, operation in enumerate(request.operations)
+    ]
+    writes = []
+    write_positions = []  # Request index of each write
+    created = {}
+    edited_ids = []
+    
+    for i, operation in enumerate(request.operations):
+        if operation.operation == 'create':
+            file_doc = {
+                "_id": str(ObjectId()),
+                "project_id": request.project_id,
+                "name": operation.file_name,
+                "path": operation.file_path,
+                **(await content_fields(operation.content)),
+                "language": operation.language,
+                "version": 1,
+                "created_at": now,
+                "updated_at": now
+            }
+            writes.append(InsertOne(file_doc))
+            created[i] = file_doc
+            results[i].file_id = file_doc["_id"]
+        elif operation.operation in ['edit', 'refactor']:
+            if not operation.file_id:
+                results[i].error = "file_id required for edit/refactor operations"
+                continue
+            writes.append(UpdateOne(
+                {"_id": operation.file_id, "project_id": request.project_id},
+                {"$set": {**(await content_fields(operation.content)), "updated_at": now}, "$inc": {"version": 1}}
+            ))
+            edited_ids.append(operation.file_id)
+            results[i].file_id = operation.file_id
+        else:
+            results[i].error = f"Invalid operation: {operation.operation}"
+            continue
+        write_positions.append(i)
+    
+    transactional = await transactions_supported()
+    # All-or-nothing: an operation rejected up front means nothing is written
+    rejected = {i: result.error for i, result in enumerate(results) if result.error}
+    if transactional and rejected:
+        return rolled_back_response(results, rejected, created)
+    
+    if writes:
+        try:
+            if transactional:
+                async with await client.start_session() as session:
+                    async with session.start_transaction():
+                        errors, edited = await write_file_batch(writes, edited_ids, request.project_id, session)
+                        # An edit of a missing file matches nothing rather than failing; roll back for it too
+                        found = {file_doc["_id"] for file_doc in edited}
+                        missing = {
+                            i: "File not found" for i in write_positions
+                            if i not in created and results[i].file_id not in found
+                        }
+                        if missing:
+                            raise BatchRolledBack(missing)
+            else:
+                errors, edited = await write_file_batch(writes, edited_ids, request.project_id)
+        except BulkWriteError as e:
+            # The transaction rolled back: nothing was applied
+            failed = e.details.get("writeErrors", [{}])[0]
+            failed_index = failed.get("index")
+            errors = {write_positions[failed_index]: failed.get("errmsg")} if failed_index is not None else {}
+            return rolled_back_response(results, errors, created)
+        except BatchRolledBack as e:
+            return rolled_back_response(results, e.errors, created)
+        except Exception as e:
+            logger.error(f"Apply AI operations error: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Operations failed: {str(e)}")
+        
+        edited_by_id = {file_doc["_id"]: file_doc for file_doc in edited}
+        for position, i in enumerate(write_positions):
+            result = results[i]
+            if position in errors:
+                result.error = errors[position]
+            elif i in created:
+                result.success = True
+                project_indexes.file_saved(created[i])
+            elif result.file_id in edited_by_id:
+                result.success = True
+            else:
+                result.error = "File not found"
+        for file_doc in edited:
+            project_indexes.file_saved(file_doc)
+    
+    applied = sum(result.success for result in results)
+    if applied:
+        project_touch_writer.touch(request.project_id, now)
+    return ApplyAIOperationsResponse(applied=applied, transactional=transactional, results=results)
+
 # ==================== CODE COMPLETION ENDPOINT ====================
 
+COMPLETION_CACHE_TTL = float(os.environ.get('COMPLETION_CACHE_TTL', '30'))
+COMPLETION_CACHE_FILES = 512
+COMPLETION_CACHE_PER_FILE = 8
+COMPLETION_WINDOW_LINES_BEFORE = int(os.environ.get('COMPLETION_WINDOW_LINES_BEFORE', '60'))
+COMPLETION_WINDOW_LINES_AFTER = int(os.environ.get('COMPLETION_WINDOW_LINES_AFTER', '20'))
+COMPLETION_WINDOW_MAX_TOKENS = int(os.environ.get('COMPLETION_WINDOW_MAX_TOKENS', '1500'))
+COMPLETION_MAX_IMPORT_LINES = 20
+
+BLOCK_HEADER_PATTERN = re.compile(
+    r"^\s*(?:export\s+)?(?:default\s+)?(?:public\s+|private\s+|protected\s+|static\s+|abstract\s+|final\s+)*(?:async\s+)?"
+    r"(?:def|class|function|interface|enum)\b"
+)
+IMPORT_LINE_PATTERN = re.compile(r"^\s*(?:import\s|from\s+\S+\s+import\s|use\s|require(?:_once)?\b|include(?:_once)?\b)|\brequire\s*\(")
+
+def indentation(line: str) -> int:
+    return len(line) - len(line.lstrip())
+
+def completion_window(code: str, cursor: int) -> Tuple[str, str, str]:
+    """
+    Bound the completion prompt regardless of file size: a window of lines around
+    the cursor, plus the file's imports and the def/class headers enclosing the
+    window that fall outside it. Returns (outline, before, after).
+    """
+    before_lines = code[:cursor].split("\n")
+    after_lines = code[cursor:].split("\n")
+    # The last line before the cursor and the first after it are the cursor line itself
+    keep_before = before_lines[-(COMPLETION_WINDOW_LINES_BEFORE + 1):]
+    keep_after = after_lines[:COMPLETION_WINDOW_LINES_AFTER + 1]
+    
+    # Text before the cursor matters most: it gets three quarters of the token budget
+    max_chars = COMPLETION_WINDOW_MAX_TOKENS * 4
+    before = "\n".join(keep_before)
+    if len(before) > max_chars * 3 // 4:
+        before = before[-(max_chars * 3 // 4):]
+        # Start on a whole line when one fits
+        before = before[before.find("\n") + 1:] if "\n" in before else before
+    after = "\n".join(keep_after)[:max_chars - len(before)]
+    
+    skipped = before_lines[:len(before_lines) - before.count("\n") - 1]
+    if not skipped:
+        return "", before, after
+    
+    imports = [line for line in skipped if IMPORT_LINE_PATTERN.match(line)][:COMPLETION_MAX_IMPORT_LINES]
+    # Walk outwards from the window collecting headers of ever shallower blocks
+    headers = []
+    indent = min((indentation(line) for line in keep_before if line.strip()), default=0)
+    for line in reversed(skipped):
+        if indent == 0:
+            break
+        if line.strip() and indentation(line) < indent and BLOCK_HEADER_PATTERN.match(line):
+            headers.append(line)
+            indent = indentation(line)
+    outline = "\n".join(imports + ["..."] + headers[::-1] if headers else imports)
+    return outline, before, after
+
+def text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+class CompletionCoordinator:
+    """
+    Keeps keystroke-driven completions cheap:
+    - identical requests in flight share one LLM call,
+    - a client's new request supersedes its previous one, whose LLM call is
+      cancelled once nobody else is waiting on it,
+    - recent suggestions are remembered briefly, so typing forward through a
+      suggestion is answered with its remainder without a new LLM call.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self._tickets: Dict[str, asyncio.Future] = {}
+        self._recent: "OrderedDict[str, List[tuple]]" = OrderedDict()
+
+    def lookup(self, file_key: str, before: str, after: str) -> Optional[CodeCompletionResponse]:
+        entries = self._recent.get(file_key, [])
+        now = time.monotonic()
+        after_digest = text_digest(after)
+        for expires, prefix_length, prefix_digest, suffix_digest, suggestions in reversed(entries):
+            if expires < now or suffix_digest != after_digest or len(before) < prefix_length:
+                continue
+            if text_digest(before[:prefix_length]) != prefix_digest:
+                continue
+            typed = before[prefix_length:]
+            remaining = [s[len(typed):] for s in suggestions if s.startswith(typed) and len(s) > len(typed)]
+            if remaining:
+                return CodeCompletionResponse(completion=remaining[0], suggestions=remaining, cached=True)
+        return None
+
+    def remember(self, file_key: str, before: str, after: str, suggestions: List[str]):
+        if not suggestions:
+            return
+        entries = self._recent.pop(file_key, [])
+        now = time.monotonic()
+        entries = [e for e in entries if e[0] >= now][-(COMPLETION_CACHE_PER_FILE - 1):]
+        entries.append((now + self.ttl, len(before), text_digest(before), text_digest(after), suggestions))
+        self._recent[file_key] = entries
+        while len(self._recent) > COMPLETION_CACHE_FILES:
+            self._recent.popitem(last=False)
+
+    async def run(self, key: str, client_id: Optional[str], factory) -> Optional[CodeCompletionResponse]:
+        """Await the completion for `key`, or None if this client superseded the request."""
+        ticket = asyncio.get_running_loop().create_future()
+        if client_id:
+            previous = self._tickets.get(client_id)
+            if previous and not previous.done():
+                previous.set_result(None)
+            self._tickets[client_id] = ticket
+        
+        task = self._inflight.get(key)
+        if not task:
+            task = asyncio.create_task(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        
+        try:
+            done, _ = await asyncio.wait({task, ticket}, return_when=asyncio.FIRST_COMPLETED)
+            if task in done:
+                return task.result()
+            return None
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                if not task.done():
+                    task.cancel()
+            if client_id and self._tickets.get(client_id) is ticket:
+                del self._tickets[client_id]
+
+completion_coordinator = CompletionCoordinator(COMPLETION_CACHE_TTL)
+
 @api_router.post("/code/complete", response_model=CodeCompletionResponse)
 async def complete_code(request: CodeCompletionRequest):
     try:
-        api_key = os.environ.get('EMERGENT_LLM_KEY')
-        if not api_key:
-            raise HTTPException(status_code=500, detail="API key not configured")
-        
         # Extract code before and after cursor
         code_before = request.code[:request.cursor_position]
         code_after = request.code[request.cursor_position:]
         
-        # Create completion prompt
-        system_message = f"You are a code completion engine. Complete the code at the cursor position. Return ONLY the completion text, no explanations. Language: {request.language}"
-        
-        prompt = f"Complete this code at the cursor (marked with <CURSOR>):\n\n{code_before}<CURSOR>{code_after}\n\nProvide 3 short completion suggestions, one per line:"
-        
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=f"completion-{uuid.uuid4()}",
-            system_message=system_message
-        ).with_model(request.provider, request.model)
-        
-        user_message = UserMessage(text=prompt)
-        response = await chat.send_message(user_message)
+        file_key = f"{request.file_id or request.client_id or ''}:{request.language}"
+        cached = completion_coordinator.lookup(file_key, code_before, code_after)
+        if cached:
+            return cached
         
-        # Parse response into suggestions
-        suggestions = [s.strip() for s in response.strip().split('\n') if s.strip()][:3]
-        main_completion = suggestions[0] if suggestions else ""
+        async def fetch_completion() -> CodeCompletionResponse:
+            # Create completion prompt from a bounded window around the cursor
+            system_message = f"You are a code completion engine. Complete the code at the cursor position. Return ONLY the completion text, no explanations. Language: {request.language}"
+            
+            outline, window_before, window_after = completion_window(request.code, request.cursor_position)
+            prompt = f"Complete this code at the cursor (marked with <CURSOR>):\n\n{window_before}<CURSOR>{window_after}\n\nProvide 3 short completion suggestions, one per line:"
+            if outline:
+                prompt = f"Imports and enclosing definitions from earlier in the file:\n\n{outline}\n\n{prompt}"
+            
+            chat = open_llm_session(
+                request.provider, request.model,
+                session_id=f"completion-{uuid.uuid4()}",
+                system_message=system_message
+            )
+            
+            response = await chat.send(prompt)
+            
+            # Parse response into suggestions
+            suggestions = [s.strip() for s in response.strip().split('\n') if s.strip()][:3]
+            main_completion = suggestions[0] if suggestions else ""
+            
+            completion_coordinator.remember(file_key, code_before, code_after, suggestions)
+            return CodeCompletionResponse(
+                completion=main_completion,
+                suggestions=suggestions
+            )
         
-        return CodeCompletionResponse(
-            completion=main_completion,
-            suggestions=suggestions
-        )
+        # Identical requests share one LLM call
+        key = text_digest(json.dumps([file_key, code_before, code_after, request.provider, request.model]))
+        response = await completion_coordinator.run(key, request.client_id, fetch_completion)
+        if response is None:
+            return CodeCompletionResponse(completion="", suggestions=[], cancelled=True)
+        return response
     
+    except HTTPException:
+        raise
+    except LlmBusy:
+        raise llm_busy_error()
     except Exception as e:
         logger.error(f"Code completion error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Completion error: {str(e)}")
 
-# ==================== CODE EXECUTION ENDPOINT ====================
+# ==================== CODE EXECUTION SANDBOX ====================
 
-@api_router.post("/code/execute", response_model=CodeExecutionResponse)
-async def execute_code(request: CodeExecutionRequest):
-    try:
-        import time
-        import subprocess
-        import tempfile
-        
-        start_time = time.time()
-        
-        if request.language == "python":
-            # Execute Python code
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-                f.write(request.code)
-                temp_file = f.name
-            
+EXECUTION_TIMEOUT = 10
+EXECUTION_POOL_SIZE = int(os.environ.get('EXECUTION_POOL_SIZE', '2'))
+EXECUTION_WORKER_MAX_USES = int(os.environ.get('EXECUTION_WORKER_MAX_USES', '50'))
+EXECUTION_WORKER_IDLE_TIMEOUT = float(os.environ.get('EXECUTION_WORKER_IDLE_TIMEOUT', '300'))
+EXECUTION_MAX_OUTPUT_LINE = 16 * 1024 * 1024
+EXECUTION_MAX_CONCURRENCY = int(os.environ.get('EXECUTION_MAX_CONCURRENCY', '4'))
+EXECUTION_MAX_QUEUE = int(os.environ.get('EXECUTION_MAX_QUEUE', '16'))
+EXECUTION_STREAM_MAX_BYTES = int(os.environ.get('EXECUTION_STREAM_MAX_BYTES', str(1024 * 1024)))
+
+# language -> (runtime, interpreter, file suffix for one-shot runs)
+EXECUTION_LANGUAGES = {
+    "python": ("python", "python3", ".py"),
+    "javascript": ("node", "node", ".js"),
+    "typescript": ("node", "node", ".js"),
+    "php": ("php", "php", ".php"),
+}
+
+# Python workers stay idle in a warm interpreter and fork a fresh child per job,
+# so user code never sees state left behind by a previous run.
+PYTHON_WORKER_BOOTSTRAP = r'''
+import sys, os, json, tempfile, traceback, types, linecache, threading, atexit
+
+def run_job(job):
+    stdin_file = tempfile.TemporaryFile()
+    stdout_file = tempfile.TemporaryFile()
+    stderr_file = tempfile.TemporaryFile()
+    stdin_file.write(job.get("stdin", "").encode())
+    stdin_file.seek(0)
+    pid = os.fork()
+    if pid == 0:
+        os.dup2(stdin_file.fileno(), 0)
+        os.dup2(stdout_file.fileno(), 1)
+        os.dup2(stderr_file.fileno(), 2)
+        sys.stdin = open(0, "r", closefd=False)
+        sys.stdout = open(1, "w", closefd=False)
+        sys.stderr = open(2, "w", closefd=False)
+        sys.argv = ["main.py"]
+        # Run as a real __main__ module with its source known, as `python main.py` would,
+        # so tracebacks show code lines and pickle and inspect find the user's definitions
+        linecache.cache["main.py"] = (len(job["code"]), None, job["code"].splitlines(True), "main.py")
+        main = types.ModuleType("__main__")
+        main.__file__ = "main.py"
+        sys.modules["__main__"] = main
+        atexit._clear()
+        exit_code = 0
+        try:
+            exec(compile(job["code"], "main.py", "exec"), main.__dict__)
+        except SystemExit as e:
+            if isinstance(e.code, int):
+                exit_code = e.code
+            elif e.code is not None:
+                print(e.code, file=sys.stderr)
+                exit_code = 1
+        except BaseException as e:
+            # Skip the worker's own frame so tracebacks start at the user's code
+            traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+            exit_code = 1
+        # Finish like the interpreter does: wait for non-daemon threads, then run atexit handlers
+        threading._shutdown()
+        atexit._run_exitfuncs()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exit_code)
+    _, status = os.waitpid(pid, 0)
+    stdout_file.seek(0)
+    stderr_file.seek(0)
+    return {
+        "stdout": stdout_file.read().decode(errors="replace"),
+        "stderr": stderr_file.read().decode(errors="replace"),
+        "returncode": os.waitstatus_to_exitcode(status),
+    }
+
+channel = os.fdopen(os.dup(1), "w")
+channel.write(json.dumps({"ready": True}) + "\n")
+channel.flush()
+for line in sys.stdin.buffer:
+    channel.write(json.dumps(run_job(json.loads(line))) + "\n")
+    channel.flush()
+'''
+
+# Node can't reset a process between jobs, so its workers are spares: started ahead of
+# time, they run a single job as the main module, exactly like `node main.js`, and exit.
+NODE_WORKER_BOOTSTRAP = r'''
+const fs = require('fs');
+const path = require('path');
+const Module = require('module');
+
+// Read straight from fd 0 without buffering ahead: whatever follows the job is the program's stdin
+const readExactly = (size) => {
+  const buffer = Buffer.alloc(size);
+  let offset = 0;
+  while (offset < size) {
+    const read = fs.readSync(0, buffer, offset, size - offset, null);
+    if (read === 0) process.exit(0);
+    offset += read;
+  }
+  return buffer;
+};
+
+// Under `node -e` the builtin modules and the script's require/module/... are globals,
+// which a program run from a file does not see. Real globals sharing a module's name stay.
+const fileGlobals = new Set(['process', 'console', 'crypto']);
+for (const name of Module.builtinModules) {
+  if (!fileGlobals.has(name) && Object.prototype.hasOwnProperty.call(globalThis, name)) {
+    delete globalThis[name];
+  }
+}
+for (const name of ['require', 'module', 'exports', '__filename', '__dirname']) {
+  delete globalThis[name];
+}
+delete process._eval;
+
+// The job is its code's length in bytes on a line of its own, then the code
+let header = '';
+for (let c = readExactly(1).toString(); c !== '\n'; c = readExactly(1).toString()) header += c;
+const code = readExactly(Number(header)).toString();
+
+const filename = path.join(process.cwd(), 'main.js');
+const main = new Module(filename, null);
+main.id = '.';
+main.filename = filename;
+main.paths = Module._nodeModulePaths(process.cwd());
+Module._cache[filename] = main;
+process.mainModule = main;
+process.argv = [process.argv[0], filename];
+main._compile(code, filename);
+main.loaded = true;
+'''
+
+WORKER_BOOTSTRAPS = {
+    "python": ["python3", "-c", PYTHON_WORKER_BOOTSTRAP],
+    "node": ["node", "-e", NODE_WORKER_BOOTSTRAP],
+}
+
+def kill_process_group(process: asyncio.subprocess.Process):
+    if process.returncode is None:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+class ExecutionWorker:
+    """A warm interpreter process that runs jobs sent as JSON lines on stdin."""
+
+    def __init__(self, runtime: str, process: asyncio.subprocess.Process):
+        self.runtime = runtime
+        self.process = process
+        self.uses = 0
+        self.last_used = time.monotonic()
+
+    @classmethod
+    async def spawn(cls, runtime: str) -> "ExecutionWorker":
+        process = await asyncio.create_subprocess_exec(
+            *WORKER_BOOTSTRAPS[runtime],
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            start_new_session=True,
+            limit=EXECUTION_MAX_OUTPUT_LINE,
+        )
+        worker = cls(runtime, process)
+        try:
+            ready = await asyncio.wait_for(process.stdout.readline(), timeout=EXECUTION_TIMEOUT)
+            if not ready:
+                raise RuntimeError(f"{runtime} worker exited during startup")
+        except BaseException:
+            worker.kill()
+            raise
+        return worker
+
+    @property
+    def alive(self) -> bool:
+        return self.process.returncode is None
+
+    async def run(self, code: str, stdin: str, timeout: float) -> Dict[str, Any]:
+        job = json.dumps({"code": code, "stdin": stdin}) + "\n"
+        self.process.stdin.write(job.encode())
+        await self.process.stdin.drain()
+        line = await asyncio.wait_for(self.process.stdout.readline(), timeout=timeout)
+        if not line:
+            raise RuntimeError(f"{self.runtime} worker exited unexpectedly")
+        self.uses += 1
+        self.last_used = time.monotonic()
+        return json.loads(line)
+
+    def kill(self):
+        # Workers lead their own process group, so forked job children die too
+        kill_process_group(self.process)
+
+class SpareWorker(ExecutionWorker):
+    """
+    An interpreter started ahead of time that runs a single job as its main program
+    and exits, for runtimes whose state can't be reset between jobs.
+    """
+
+    @classmethod
+    async def spawn(cls, runtime: str) -> "SpareWorker":
+        process = await asyncio.create_subprocess_exec(
+            *WORKER_BOOTSTRAPS[runtime],
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+        )
+        return cls(runtime, process)
+
+    async def run(self, code: str, stdin: str, timeout: float) -> Dict[str, Any]:
+        # The code's length in bytes, the code, then the program's own stdin
+        payload = code.encode()
+        job = f"{len(payload)}\n".encode() + payload + stdin.encode()
+        stdout, stderr = await asyncio.wait_for(self.process.communicate(job), timeout=timeout)
+        self.uses += 1
+        return {
+            "stdout": stdout.decode(errors="replace"),
+            "stderr": stderr.decode(errors="replace"),
+            "returncode": self.process.returncode,
+        }
+
+EXECUTION_WORKER_TYPES = {
+    "python": ExecutionWorker,
+    "node": SpareWorker,
+}
+
+class WorkerPool:
+    """
+    Bounded pool of warm workers for a single runtime.
+    At most `size` jobs run at once; callers beyond that wait for a free slot.
+    Workers are recycled after `max_uses` jobs and reaped after `idle_timeout` seconds idle.
+    Discarded workers are replaced in the background, so the next job finds one warm.
+    """
+
+    def __init__(self, runtime: str, size: int, max_uses: int, idle_timeout: float):
+        self.runtime = runtime
+        self.size = size
+        self.max_uses = max_uses
+        self.idle_timeout = idle_timeout
+        self.worker_type = EXECUTION_WORKER_TYPES[runtime]
+        self._slots = asyncio.Semaphore(size)
+        self._idle: List[ExecutionWorker] = []
+        self._reaper: Optional[asyncio.Task] = None
+        self._refill: Optional[asyncio.Task] = None
+
+    async def start(self):
+        for _ in range(self.size):
+            self._idle.append(await self.worker_type.spawn(self.runtime))
+        self._reaper = asyncio.create_task(self._reap_idle())
+
+    async def execute(self, code: str, stdin: str, timeout: float) -> Dict[str, Any]:
+        async with self._slots:
+            worker = self._idle.pop() if self._idle else await self.worker_type.spawn(self.runtime)
             try:
-                result = subprocess.run(
-                    ['python3', temp_file],
-                    capture_output=True,
-                    text=True,
-                    timeout=10,
-                    input='\n'.join(request.inputs) if request.inputs else None
-                )
-                execution_time = time.time() - start_time
-                
-                if result.returncode == 0:
-                    return CodeExecutionResponse(
-                        output=result.stdout,
-                        error=None,
-                        execution_time=execution_time
-                    )
-                else:
-                    return CodeExecutionResponse(
-                        output=result.stdout,
-                        error=result.stderr,
-                        execution_time=execution_time
-                    )
-            finally:
-                os.unlink(temp_file)
-        
-        elif request.language in ["javascript", "typescript"]:
-            # Execute JavaScript/TypeScript code using Node.js
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.js', delete=False) as f:
-                f.write(request.code)
-                temp_file = f.name
-            
+                result = await worker.run(code, stdin, timeout)
+            except BaseException:
+                # Timed out or broken mid-job: the worker's state is unknown, discard it
+                worker.kill()
+                self._replace()
+                raise
+            if worker.uses >= self.max_uses or not worker.alive or len(self._idle) >= self.size:
+                worker.kill()
+                self._replace()
+            else:
+                self._idle.append(worker)
+            return result
+
+    def _replace(self):
+        if self._refill is None or self._refill.done():
+            self._refill = asyncio.create_task(self._fill())
+
+    async def _fill(self):
+        while len(self._idle) < self.size:
             try:
-                result = subprocess.run(
-                    ['node', temp_file],
-                    capture_output=True,
-                    text=True,
-                    timeout=10,
-                    input='\n'.join(request.inputs) if request.inputs else None
-                )
-                execution_time = time.time() - start_time
-                
-                if result.returncode == 0:
-                    return CodeExecutionResponse(
-                        output=result.stdout,
-                        error=None,
-                        execution_time=execution_time
-                    )
-                else:
-                    return CodeExecutionResponse(
-                        output=result.stdout,
-                        error=result.stderr,
-                        execution_time=execution_time
-                    )
-            finally:
-                os.unlink(temp_file)
+                worker = await self.worker_type.spawn(self.runtime)
+            except Exception as e:
+                logger.warning(f"Failed to start a spare {self.runtime} worker: {str(e)}")
+                return
+            self._idle.append(worker)
+
+    async def _reap_idle(self):
+        while True:
+            await asyncio.sleep(min(self.idle_timeout, 30))
+            cutoff = time.monotonic() - self.idle_timeout
+            for worker in [w for w in self._idle if w.last_used < cutoff or not w.alive]:
+                self._idle.remove(worker)
+                worker.kill()
+
+    async def close(self):
+        for task in (self._reaper, self._refill):
+            if task:
+                task.cancel()
+        for worker in self._idle:
+            worker.kill()
+        self._idle.clear()
+
+execution_pools: Dict[str, WorkerPool] = {}
+
+async def start_execution_pools():
+    if EXECUTION_POOL_SIZE <= 0:
+        return
+    for runtime, command in WORKER_BOOTSTRAPS.items():
+        if not shutil.which(command[0]):
+            logger.warning(f"{command[0]} not found, {runtime} runs without a worker pool")
+            continue
+        pool = WorkerPool(runtime, EXECUTION_POOL_SIZE, EXECUTION_WORKER_MAX_USES, EXECUTION_WORKER_IDLE_TIMEOUT)
+        try:
+            await pool.start()
+        except Exception as e:
+            logger.error(f"Failed to start {runtime} worker pool: {str(e)}")
+            await pool.close()
+            continue
+        execution_pools[runtime] = pool
+
+async def stop_execution_pools():
+    for pool in execution_pools.values():
+        await pool.close()
+    execution_pools.clear()
+
+class ExecutionQueueFull(Exception):
+    pass
+
+class ExecutionLimiter:
+    """
+    Process-wide cap on concurrent code executions.
+    Requests beyond `concurrency` wait in line; once `max_queue` are already waiting,
+    new ones are rejected immediately instead of piling up.
+    """
+
+    def __init__(self, concurrency: int, max_queue: int):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.running = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    @property
+    def full(self) -> bool:
+        return self._semaphore.locked() and self.waiting >= self.max_queue
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.full:
+            raise ExecutionQueueFull()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+
+execution_limiter = ExecutionLimiter(EXECUTION_MAX_CONCURRENCY, EXECUTION_MAX_QUEUE)
+
+async def run_one_shot(interpreter: str, suffix: str, code: str, stdin: Optional[str], timeout: float) -> Dict[str, Any]:
+    with tempfile.NamedTemporaryFile(mode='w', suffix=suffix, delete=False) as f:
+        f.write(code)
+        temp_file = f.name
+    
+    try:
+        process = await asyncio.create_subprocess_exec(
+            interpreter, temp_file,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(stdin.encode() if stdin else None),
+                timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            kill_process_group(process)
+            await process.wait()
+            raise
+        return {
+            "stdout": stdout.decode(errors="replace"),
+            "stderr": stderr.decode(errors="replace"),
+            "returncode": process.returncode,
+        }
+    finally:
+        os.unlink(temp_file)
+
+async def stream_one_shot(runtime: str, interpreter: str, suffix: str, code: str, stdin: Optional[str]):
+    """
+    Run code in a fresh process once an execution slot is free, and yield its output
+    as SSE events while it runs. When the queue is full, a single `error` event is
+    sent instead, as the response has already started.
+    """
+    try:
+        async with execution_limiter.slot():
+            async for event in stream_process(runtime, interpreter, suffix, code, stdin):
+                yield event
+    except ExecutionQueueFull:
+        yield sse_event("error", {"detail": "Too many code executions in progress, try again shortly"})
+
+async def stream_process(runtime: str, interpreter: str, suffix: str, code: str, stdin: Optional[str]):
+    """
+    Run code in a fresh process and yield its output as SSE events while it runs.
+    Emits `stdout`/`stderr` events, then a final `exit` event. Output past
+    EXECUTION_STREAM_MAX_BYTES bytes stops the process, so nothing large is ever buffered.
+    """
+    # The clock starts once the run has a slot, so queueing never eats into its timeout
+    start_time = time.time()
+    with tempfile.NamedTemporaryFile(mode='w', suffix=suffix, delete=False) as f:
+        f.write(code)
+        temp_file = f.name
+    
+    # Unbuffered so Python output arrives as it is printed
+    args = [interpreter, "-u", temp_file] if runtime == "python" else [interpreter, temp_file]
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True,
+    )
+    # Small queue so a slow client applies backpressure to the pipes
+    chunks: asyncio.Queue = asyncio.Queue(maxsize=8)
+    
+    async def pump(stream: asyncio.StreamReader, name: str):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while True:
+            data = await stream.read(4096)
+            text = decoder.decode(data, final=not data)
+            if text:
+                await chunks.put((name, text))
+            if not data:
+                break
+        await chunks.put((name, None))
+    
+    pumps = [
+        asyncio.create_task(pump(process.stdout, "stdout")),
+        asyncio.create_task(pump(process.stderr, "stderr")),
+    ]
+    try:
+        if stdin:
+            process.stdin.write(stdin.encode())
+        process.stdin.close()
         
-        elif request.language == "php":
-            # Execute PHP code
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.php', delete=False) as f:
-                f.write(request.code)
-                temp_file = f.name
-            
+        deadline = start_time + EXECUTION_TIMEOUT
+        open_streams = len(pumps)
+        sent = 0
+        timed_out = truncated = False
+        while open_streams:
             try:
-                result = subprocess.run(
-                    ['php', temp_file],
-                    capture_output=True,
-                    text=True,
-                    timeout=10,
-                    input='\n'.join(request.inputs) if request.inputs else None
-                )
-                execution_time = time.time() - start_time
-                
-                if result.returncode == 0:
-                    return CodeExecutionResponse(
-                        output=result.stdout,
-                        error=None,
-                        execution_time=execution_time
-                    )
-                else:
-                    return CodeExecutionResponse(
-                        output=result.stdout,
-                        error=result.stderr,
-                        execution_time=execution_time
-                    )
-            finally:
-                os.unlink(temp_file)
+                name, text = await asyncio.wait_for(chunks.get(), timeout=max(deadline - time.time(), 0))
+            except asyncio.TimeoutError:
+                timed_out = True
+                break
+            if text is None:
+                open_streams -= 1
+                continue
+            size = len(text.encode())
+            if sent + size > EXECUTION_STREAM_MAX_BYTES:
+                # Cut on a character boundary within the bytes left
+                text = text.encode()[:EXECUTION_STREAM_MAX_BYTES - sent].decode(errors="ignore")
+                size = len(text.encode())
+                truncated = True
+            sent += size
+            if text:
+                yield sse_event(name, {"data": text})
+            if truncated:
+                break
         
-        else:
+        if timed_out or truncated:
+            kill_process_group(process)
+        await process.wait()
+        if timed_out:
+            yield sse_event("stderr", {"data": f"Code execution timeout ({EXECUTION_TIMEOUT} seconds)\n"})
+        elif truncated:
+            yield sse_event("stderr", {"data": f"Output limit reached ({EXECUTION_STREAM_MAX_BYTES} bytes), execution stopped\n"})
+        yield sse_event("exit", {
+            "returncode": process.returncode,
+            "execution_time": time.time() - start_time,
+            "timed_out": timed_out,
+            "truncated": truncated,
+        })
+    finally:
+        kill_process_group(process)
+        for task in pumps:
+            task.cancel()
+        os.unlink(temp_file)
+
+# ==================== EXECUTION RESULT CACHE ====================
+
+EXECUTION_CACHE_SIZE = int(os.environ.get('EXECUTION_CACHE_SIZE', '256'))
+EXECUTION_CACHE_TTL = float(os.environ.get('EXECUTION_CACHE_TTL', '600'))
+
+# Whether a run may be cached is decided from the code alone, conservatively: Python
+# is parsed and may only import allowlisted modules; JavaScript and PHP are checked
+# for whole words naming clocks, randomness, the environment, files, processes and
+# the network. Known gaps: names reached dynamically (getattr, globalThis[...],
+# variable functions in PHP) and objects whose default repr shows a memory address,
+# which is why outputs containing an address are never cached either.
+
+# Python modules safe to import, mapped to the attributes allowed on them (None: all)
+CACHEABLE_PYTHON_MODULES: Dict[str, Optional[frozenset]] = {
+    **{module: None for module in (
+        "math", "cmath", "decimal", "fractions", "statistics", "numbers", "operator",
+        "itertools", "functools", "collections", "collections.abc", "heapq", "bisect",
+        "array", "copy", "string", "re", "textwrap", "unicodedata", "json", "enum",
+        "dataclasses", "typing", "abc", "pprint", "keyword",
+    )},
+    "sys": frozenset({
+        "stdin", "stdout", "stderr", "setrecursionlimit", "getrecursionlimit", "maxsize",
+        "exit", "version_info", "float_info", "int_info", "byteorder",
+    }),
+}
+# Builtins whose result differs between runs, or between pool and one-shot runs
+NONDETERMINISTIC_PYTHON_NAMES = frozenset({
+    "open", "id", "hash", "__import__", "exec", "eval", "compile", "breakpoint",
+    "globals", "locals", "vars", "__file__", "__builtins__",
+    # Iteration order of str sets depends on the per-process hash seed
+    "set", "frozenset",
+})
+NONDETERMINISTIC_JS_PATTERN = re.compile(
+    r"\b(?:Math\s*\.\s*random|Date|performance|process|crypto|fetch|XMLHttpRequest|WebSocket|"
+    r"eval|Function|WeakRef|FinalizationRegistry|global|globalThis|__filename|__dirname|import)\b"
+)
+JS_REQUIRE_PATTERN = re.compile(r"\brequire\s*\(\s*(?:'([^']*)'|\"([^\"]*)\"|`([^`]*)`)?")
+CACHEABLE_JS_MODULES = frozenset({"assert", "util", "events", "string_decoder", "querystring", "url", "buffer"})
+NONDETERMINISTIC_PHP_PATTERN = re.compile(
+    r"\b(?:rand|mt_rand|random_int|random_bytes|shuffle|str_shuffle|array_rand|uniqid|lcg_value|"
+    r"time|microtime|hrtime|date|gmdate|mktime|strtotime|date_create|getdate|localtime|"
+    r"getmypid|getenv|putenv|sys_get_temp_dir|spl_object_id|spl_object_hash|"
+    r"fopen|file|file_get_contents|file_put_contents|glob|scandir|opendir|readdir|is_file|file_exists|"
+    r"exec|shell_exec|system|passthru|proc_open|popen|fsockopen|curl_init|curl_exec|"
+    r"eval|call_user_func|call_user_func_array)\s*\("
+    r"|\b(?:DateTime|DateTimeImmutable|Random|SplFileObject|include|include_once|require|require_once)\b"
+    r"|\$_(?:SERVER|ENV|GET|POST|COOKIE|FILES|REQUEST|SESSION)\b|`",
+    re.IGNORECASE
+)
+# Default object reprs (<Foo object at 0x7f...>, var_dump ids) differ on every run
+MEMORY_ADDRESS_PATTERN = re.compile(r"0x[0-9a-fA-F]{6,}")
+
+class ExecutionCache:
+    """LRU cache of execution results with a TTL, keyed by a hash of everything that affects the output."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    @staticmethod
+    def key(language: str, code: str, inputs: List[str], runtime_version: str) -> str:
+        payload = json.dumps([language, code, inputs, runtime_version])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry:
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: Dict[str, Any]):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+        }
+
+execution_cache = ExecutionCache(EXECUTION_CACHE_SIZE, EXECUTION_CACHE_TTL)
+runtime_versions: Dict[str, str] = {}
+
+def is_cacheable_python(code: str) -> bool:
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return False
+    
+    module_aliases = {}  # Local name -> allowlisted module it is bound to
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.name not in CACHEABLE_PYTHON_MODULES:
+                    return False
+                module_aliases[alias.asname or alias.name.split(".")[0]] = alias.name
+        elif isinstance(node, ast.ImportFrom):
+            allowed = CACHEABLE_PYTHON_MODULES.get(node.module, ()) if not node.level else ()
+            if allowed == ():
+                return False
+            if allowed is not None and any(alias.name not in allowed for alias in node.names):
+                return False
+        elif isinstance(node, ast.Name) and node.id in NONDETERMINISTIC_PYTHON_NAMES:
+            return False
+        elif isinstance(node, (ast.Set, ast.SetComp)):
+            return False
+    
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id in module_aliases:
+            allowed = CACHEABLE_PYTHON_MODULES[module_aliases[node.value.id]]
+            if allowed is not None and node.attr not in allowed:
+                return False
+    return True
+
+def is_cacheable_javascript(code: str) -> bool:
+    if NONDETERMINISTIC_JS_PATTERN.search(code):
+        return False
+    for match in JS_REQUIRE_PATTERN.finditer(code):
+        module = next((group for group in match.groups() if group is not None), None)
+        # A computed require() could load anything
+        if module is None or module.removeprefix("node:") not in CACHEABLE_JS_MODULES:
+            return False
+    return True
+
+def is_cacheable_code(language: str, code: str) -> bool:
+    runtime = EXECUTION_LANGUAGES[language][0]
+    if runtime == "python":
+        return is_cacheable_python(code)
+    if runtime == "node":
+        return is_cacheable_javascript(code)
+    return not NONDETERMINISTIC_PHP_PATTERN.search(code)
+
+async def get_runtime_version(interpreter: str) -> str:
+    if interpreter not in runtime_versions:
+        process = await asyncio.create_subprocess_exec(
+            interpreter, "--version",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+        stdout, _ = await process.communicate()
+        runtime_versions[interpreter] = stdout.decode(errors="replace").strip()
+    return runtime_versions[interpreter]
+
+# ==================== CODE EXECUTION ENDPOINT ====================
+
+@api_router.post("/code/execute", response_model=CodeExecutionResponse)
+async def execute_code(request: CodeExecutionRequest):
+    start_time = time.time()
+    try:
+        if request.language not in EXECUTION_LANGUAGES:
             return CodeExecutionResponse(
                 output="",
                 error=f"Language '{request.language}' not supported for execution",
                 execution_time=time.time() - start_time
             )
+        
+        runtime, interpreter, suffix = EXECUTION_LANGUAGES[request.language]
+        stdin = '\n'.join(request.inputs) if request.inputs else None
+        pool = execution_pools.get(runtime)
+        
+        cache_key = None
+        if request.use_cache and is_cacheable_code(request.language, request.code):
+            cache_key = ExecutionCache.key(
+                request.language, request.code, request.inputs or [], await get_runtime_version(interpreter)
+            )
+            cached = execution_cache.get(cache_key)
+            if cached:
+                return CodeExecutionResponse(**cached, cached=True)
+        
+        async with execution_limiter.slot():
+            if pool:
+                result = await pool.execute(request.code, stdin or "", EXECUTION_TIMEOUT)
+            else:
+                result = await run_one_shot(interpreter, suffix, request.code, stdin, EXECUTION_TIMEOUT)
+        
+        response = CodeExecutionResponse(
+            output=result["stdout"],
+            error=None if result["returncode"] == 0 else result["stderr"],
+            execution_time=time.time() - start_time
+        )
+        if cache_key and not MEMORY_ADDRESS_PATTERN.search(response.output + (response.error or "")):
+            execution_cache.put(cache_key, response.dict(exclude={"cached"}))
+        return response
     
-    except subprocess.TimeoutExpired:
+    except ExecutionQueueFull:
+        raise HTTPException(status_code=503, detail="Too many code executions in progress, try again shortly")
+    except asyncio.TimeoutError:
         return CodeExecutionResponse(
             output="",
-            error="Code execution timeout (10 seconds)",
-            execution_time=10.0
+            error=f"Code execution timeout ({EXECUTION_TIMEOUT} seconds)",
+            execution_time=float(EXECUTION_TIMEOUT)
         )
     except Exception as e:
         logger.error(f"Code execution error: {str(e)}")
@@ -693,6 +3587,54 @@ async def execute_code(request: CodeExecutionRequest):
             execution_time=time.time() - start_time
         )
 
+@api_router.post("/code/execute/stream")
+async def execute_code_stream(request: CodeExecutionRequest):
+    """
+    Streaming variant of /code/execute. Responds with Server-Sent Events:
+    `stdout` and `stderr` events carry output as it is produced, and a final
+    `exit` event carries the return code and execution time. If the execution
+    queue fills up before the run starts, an `error` event is sent instead.
+    """
+    if request.language not in EXECUTION_LANGUAGES:
+        raise HTTPException(status_code=400, detail=f"Language '{request.language}' not supported for execution")
+    if execution_limiter.full:
+        raise HTTPException(status_code=503, detail="Too many code executions in progress, try again shortly")
+    
+    runtime, interpreter, suffix = EXECUTION_LANGUAGES[request.language]
+    stdin = '\n'.join(request.inputs) if request.inputs else None
+    return sse_response(stream_one_shot(runtime, interpreter, suffix, request.code, stdin))
+
+@api_router.get("/code/cache/stats")
+async def get_execution_cache_stats():
+    return execution_cache.stats()
+
+# ==================== ADMIN ENDPOINTS ====================
+
+@api_router.get("/admin/indexes")
+async def get_index_stats():
+    """
+    Report each index on the hot collections with its usage counters since the
+    server started, so unused indexes and missing ones show up quickly.
+    """
+    stats = {}
+    for collection in INDEXES:
+        indexes = await db[collection].aggregate([{"$indexStats": {}}]).to_list(None)
+        stats[collection] = [
+            {
+                "name": index["name"],
+                "key": index["key"],
+                "ops": index["accesses"]["ops"],
+                "since": index["accesses"]["since"],
+            }
+            for index in indexes
+        ]
+    return stats
+
+@api_router.get("/admin/llm")
+async def get_llm_stats():
+    """Upstream LLM calls running and queued per provider/model."""
+    return llm_limiter.stats()
+
 # ==================== BASIC ROUTES ====================
 
 @api_router.get("/")
@@ -715,6 +3657,20 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+@app.on_event("startup")
+async def startup_background_services():
+    await ensure_indexes()
+    project_touch_writer.start()
+    chat_history_writer.start()
+    file_chunk_sweeper.start()
+    llm_http.start()
+    await start_execution_pools()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await stop_execution_pools()
+    await llm_http.stop()
+    await chat_history_writer.stop()
+    await file_chunk_sweeper.stop()
+    await project_touch_writer.stop()
     client.close()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Mobile IDE Backend Benchmarks
+Measures hot backend paths directly against MongoDB, comparing the previous
+implementation of each path with the current one. AI endpoints run against the
+offline "local" LLM provider, so no tokens are spent and no network is needed
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+from bson import ObjectId
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+load_dotenv(Path(__file__).parent / 'backend' / '.env')
+
+class MobileIDEBenchmark:
+    def __init__(self, concurrency, saves, chats):
+        self.concurrency = concurrency
+        self.saves = saves
+        self.chats = chats
+        self.client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        # Scratch database so benchmarks never touch real data
+        self.db_name = f"benchmark_{uuid.uuid4().hex[:8]}"
+        self.db = self.client[self.db_name]
+        self.file_ids = []
+        self.project_id = None
+        self.server = self.load_server()
+
+    async def setup(self):
+        now = datetime.utcnow()
+        self.project_id = str(ObjectId())
+        await self.db.projects.insert_one({
+            "_id": self.project_id,
+            "name": "Benchmark",
+            "description": "",
+            "created_at": now,
+            "updated_at": now
+        })
+        files = [{
+            "_id": str(ObjectId()),
+            "project_id": self.project_id,
+            "name": f"file_{i}.py",
+            "path": f"file_{i}.py",
+            "content": "print('hello')\n" * 200,
+            "language": "python",
+            "version": 1,
+            "created_at": now,
+            "updated_at": now
+        } for i in range(self.concurrency)]
+        await self.db.files.insert_many(files)
+        self.file_ids = [f["_id"] for f in files]
+
+    async def cleanup(self):
+        await self.client.drop_database(self.db_name)
+        self.client.close()
+
+    async def save_legacy(self, file_id, content):
+        """update_file before the single round trip rework: four sequential round trips"""
+        now = datetime.utcnow()
+        await self.db.files.update_one({"_id": file_id}, {"$set": {"content": content, "updated_at": now}})
+        file_doc = await self.db.files.find_one({"_id": file_id})
+        await self.db.projects.update_one({"_id": file_doc["project_id"]}, {"$set": {"updated_at": now}})
+        return await self.db.files.find_one({"_id": file_id})
+
+    async def save_current(self, file_id, content):
+        """The app's own update_file: one find_one_and_update, project timestamp coalesced and flushed later"""
+        return await self.server.update_file(file_id, self.server.FileUpdate(content=content))
+
+    async def run_saves(self, save):
+        latencies = []
+
+        async def client_loop(file_id):
+            for i in range(self.saves):
+                start = time.perf_counter()
+                await save(file_id, f"print({i})\n" * 200)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[client_loop(file_id) for file_id in self.file_ids])
+        return latencies, time.perf_counter() - start
+
+    def report(self, name, latencies, elapsed, unit="saves/s", first_tokens=None):
+        latencies = sorted(latencies)
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        print(f"{name}:")
+        print(f"   mean {statistics.mean(latencies):.2f} ms | p50 {statistics.median(latencies):.2f} ms | p95 {p95:.2f} ms")
+        print(f"   {len(latencies) / elapsed:.0f} {unit}")
+        if first_tokens:
+            print(f"   first token p50 {statistics.median(first_tokens):.2f} ms")
+        print()
+
+    async def benchmark_file_saves(self):
+        print(f"File saves ({self.concurrency} concurrent clients x {self.saves} saves)")
+        print("-" * 60)
+        latencies, elapsed = await self.run_saves(self.save_legacy)
+        self.report("Before (4 round trips)", latencies, elapsed)
+        
+        # Project timestamps are flushed in the background, as in the running app
+        self.server.project_touch_writer.start()
+        try:
+            latencies, elapsed = await self.run_saves(self.save_current)
+        finally:
+            await self.server.project_touch_writer.stop()
+        self.report("After (PUT /api/files/{id})", latencies, elapsed)
+
+    def load_server(self):
+        """Import the app's server module with its database pointed at the scratch db"""
+        sys.path.insert(0, str(Path(__file__).parent / 'backend'))
+        import server
+        server.client = self.client
+        server.db = self.db
+        return server
+
+    async def run_chats(self, send):
+        latencies = []
+        first_tokens = []
+
+        async def client_loop(client_index):
+            for i in range(self.chats):
+                start = time.perf_counter()
+                first = await send(f"bench-{client_index}", f"Question {client_index}-{i}: how do I reverse a list?")
+                latencies.append((time.perf_counter() - start) * 1000)
+                if first is not None:
+                    first_tokens.append((first - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[client_loop(i) for i in range(self.concurrency)])
+        return latencies, first_tokens, time.perf_counter() - start
+
+    async def benchmark_chat(self):
+        server = self.server
+        print(f"AI chat, local provider ({self.concurrency} concurrent clients x {self.chats} turns)")
+        print(f"   stand-in model: {server.LOCAL_LLM_LATENCY_MS:.0f} ms median first token, "
+              f"{server.LOCAL_LLM_TOKENS_PER_SECOND:.0f} tokens/s")
+        print("-" * 60)
+
+        async def send_chat(session_id, message):
+            await server.chat_with_ai(server.ChatRequest(
+                message=message, session_id=session_id, provider=server.LOCAL_LLM_PROVIDER, model="bench"
+            ))
+            return None
+
+        async def stream_chat(session_id, message):
+            request = server.ChatRequest(
+                message=message, session_id=session_id, provider=server.LOCAL_LLM_PROVIDER, model="bench"
+            )
+            response = await server.chat_with_ai_stream(request)
+            first = None
+            async for event in response.body_iterator:
+                if first is None and event.startswith("event: token"):
+                    first = time.perf_counter()
+            return first
+
+        # Chat history is persisted in the background, as in the running app
+        server.chat_history_writer.start()
+        try:
+            for name, send in [("POST /api/chat", send_chat), ("POST /api/chat/stream", stream_chat)]:
+                latencies, first_tokens, elapsed = await self.run_chats(send)
+                self.report(name, latencies, elapsed, unit="turns/s", first_tokens=first_tokens)
+        finally:
+            await server.chat_history_writer.stop()
+
+    async def run_all(self):
+        print("=" * 60)
+        print("MOBILE IDE BACKEND BENCHMARKS")
+        print("=" * 60)
+        print(f"MongoDB: {os.environ['MONGO_URL']} (scratch db {self.db_name})")
+        print()
+
+        await self.setup()
+        try:
+            await self.benchmark_file_saves()
+            if self.chats:
+                await self.benchmark_chat()
+        finally:
+            await self.cleanup()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Mobile IDE backend hot paths")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent clients")
+    parser.add_argument("--saves", type=int, default=50, help="Saves per client")
+    parser.add_argument("--chats", type=int, default=10, help="AI chat turns per client (0 skips the AI benchmark)")
+    args = parser.parse_args()
+    asyncio.run(MobileIDEBenchmark(args.concurrency, args.saves, args.chats).run_all())
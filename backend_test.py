@@ -269,6 +269,146 @@ class MobileIDEAPITester:
             self.log_result("Update File", False, f"Exception: {str(e)}")
             return False
 
+    def test_patch_file(self):
+        """Test incremental file save with text edits"""
+        if not self.test_file_id:
+            self.log_result("Patch File", False, "No test file ID available")
+            return False
+            
+        try:
+            current = self.session.get(f"{self.base_url}/files/{self.test_file_id}").json()
+            patch_data = {
+                "base_version": current.get("version", 0),
+                "edits": [{"start": 0, "end": 0, "text": "// patched\n"}]
+            }
+            
+            response = self.session.patch(
+                f"{self.base_url}/files/{self.test_file_id}",
+                json=patch_data
+            )
+            
+            if response.status_code == 200:
+                data = response.json()
+                stale = self.session.patch(
+                    f"{self.base_url}/files/{self.test_file_id}",
+                    json=patch_data
+                )
+                if data.get("version") == patch_data["base_version"] + 1 and "content" not in data and stale.status_code == 409:
+                    self.log_result("Patch File", True, f"Patched to version {data['version']}, stale patch rejected")
+                    return True
+                else:
+                    self.log_result("Patch File", False, f"Unexpected response: {data}, stale patch HTTP {stale.status_code}")
+                    return False
+            else:
+                self.log_result("Patch File", False, f"HTTP {response.status_code}", response)
+                return False
+        except Exception as e:
+            self.log_result("Patch File", False, f"Exception: {str(e)}")
+            return False
+
+    def test_patch_file_with_emoji(self):
+        """Test that patch offsets count UTF-16 code units, as the editor's JavaScript strings do"""
+        if not self.test_project_id:
+            self.log_result("Patch File With Emoji", False, "No test project ID available")
+            return False
+            
+        try:
+            content = "const face = '😀';\nconst count = 1;\n"
+            file_data = {
+                "project_id": self.test_project_id,
+                "name": "emoji.js",
+                "path": "/emoji.js",
+                "content": content,
+                "language": "javascript"
+            }
+            created = self.session.post(f"{self.base_url}/files", json=file_data).json()
+            file_id = created.get("id") or created.get("_id")
+            
+            # The emoji is one Python character but two UTF-16 code units
+            index = content.index("1")
+            start = len(content[:index].encode("utf-16-le")) // 2
+            patch_data = {
+                "base_version": created.get("version", 1),
+                "edits": [{"start": start, "end": start + 1, "text": "2"}]
+            }
+            response = self.session.patch(f"{self.base_url}/files/{file_id}", json=patch_data)
+            
+            if response.status_code == 200:
+                patched = self.session.get(f"{self.base_url}/files/{file_id}/content").json()
+                expected = content.replace("1", "2")
+                if patched.get("content") == expected:
+                    self.log_result("Patch File With Emoji", True, "UTF-16 offsets applied after a non-BMP character")
+                    return True
+                else:
+                    self.log_result("Patch File With Emoji", False, f"Unexpected content: {patched.get('content')!r}")
+                    return False
+            else:
+                self.log_result("Patch File With Emoji", False, f"HTTP {response.status_code}", response)
+                return False
+        except Exception as e:
+            self.log_result("Patch File With Emoji", False, f"Exception: {str(e)}")
+            return False
+
+    def test_apply_ai_operations(self):
+        """Test applying a batch of AI file operations in one request"""
+        if not self.test_project_id or not self.test_file_id:
+            self.log_result("Apply AI Operations", False, "No test project or file ID available")
+            return False
+            
+        try:
+            batch_data = {
+                "project_id": self.test_project_id,
+                "operations": [
+                    {
+                        "operation": "create",
+                        "file_name": "batch.py",
+                        "file_path": "/batch.py",
+                        "content": "print('created in batch')",
+                        "language": "python",
+                        "description": "Create batch.py"
+                    },
+                    {
+                        "operation": "edit",
+                        "file_id": self.test_file_id,
+                        "file_name": "Calculator.js",
+                        "file_path": "/src/components/Calculator.js",
+                        "content": "console.log('edited in batch');",
+                        "language": "javascript",
+                        "description": "Edit Calculator.js"
+                    },
+                    {
+                        "operation": "edit",
+                        "file_name": "missing.js",
+                        "file_path": "/missing.js",
+                        "content": "",
+                        "language": "javascript",
+                        "description": "Edit without file_id"
+                    }
+                ]
+            }
+            
+            response = self.session.post(f"{self.base_url}/ai/apply-operations", json=batch_data)
+            
+            if response.status_code == 200:
+                data = response.json()
+                outcomes = [result["success"] for result in data.get("results", [])]
+                # In a transaction the invalid edit rolls back the whole batch
+                if data.get("transactional") and data.get("applied") == 0 and outcomes == [False, False, False]:
+                    self.log_result("Apply AI Operations", True, "Batch with an invalid operation rolled back (transactional)")
+                    return True
+                if not data.get("transactional") and data.get("applied") == 2 and outcomes == [True, True, False]:
+                    self.log_result("Apply AI Operations", True, "Applied 2 of 3 operations (not transactional)")
+                    return True
+                else:
+                    self.log_result("Apply AI Operations", False, f"Unexpected response: {data}")
+                    return False
+            else:
+                self.log_result("Apply AI Operations", False, f"HTTP {response.status_code}", response)
+                return False
+        except Exception as e:
+            self.log_result("Apply AI Operations", False, f"Exception: {str(e)}")
+            return False
+
     def test_ai_chat_openai(self):
         """Test AI chat with OpenAI"""
         try:
@@ -409,6 +549,45 @@ class MobileIDEAPITester:
             self.log_result("Code Execution (Python)", False, f"Exception: {str(e)}")
             return False
 
+    def test_code_execution_stream(self):
+        """Test streaming code execution (Server-Sent Events)"""
+        try:
+            code_data = {
+                "code": "for i in range(3):\n    print(f'line {i}')",
+                "language": "python",
+                "inputs": []
+            }
+            
+            response = self.session.post(
+                f"{self.base_url}/code/execute/stream",
+                json=code_data,
+                stream=True
+            )
+            
+            if response.status_code == 200:
+                events = []
+                event_name = None
+                for line in response.iter_lines(decode_unicode=True):
+                    if line.startswith("event: "):
+                        event_name = line[len("event: "):]
+                    elif line.startswith("data: "):
+                        events.append((event_name, json.loads(line[len("data: "):])))
+                
+                output = "".join(data["data"] for name, data in events if name == "stdout")
+                exit_events = [data for name, data in events if name == "exit"]
+                if "line 2" in output and exit_events and exit_events[0]["returncode"] == 0:
+                    self.log_result("Code Execution (Stream)", True, f"Received {len(events)} events")
+                    return True
+                else:
+                    self.log_result("Code Execution (Stream)", False, f"Unexpected events: {events}")
+                    return False
+            else:
+                self.log_result("Code Execution (Stream)", False, f"HTTP {response.status_code}", response)
+                return False
+        except Exception as e:
+            self.log_result("Code Execution (Stream)", False, f"Exception: {str(e)}")
+            return False
+
     def test_code_execution_javascript(self):
         """Test JavaScript code execution"""
         try:
@@ -565,6 +744,9 @@ class MobileIDEAPITester:
         self.test_get_project_files()
         self.test_get_file_by_id()
         self.test_update_file()
+        self.test_patch_file()
+        self.test_patch_file_with_emoji()
+        self.test_apply_ai_operations()
         
         # AI integration tests
         self.test_ai_chat_openai()
@@ -574,6 +756,7 @@ class MobileIDEAPITester:
         
         # Code execution tests
         self.test_code_execution_python()
+        self.test_code_execution_stream()
         self.test_code_execution_javascript()
         self.test_code_execution_php()
         
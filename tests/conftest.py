@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The backend is a single module, imported as `server` like the app itself does
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
@@ -0,0 +1,40 @@
+import asyncio
+import types
+
+import server
+
+class SlowHistory:
+    """A chat_history collection whose writes wait until released."""
+    
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.documents = []
+    
+    async def insert_many(self, documents, ordered=True):
+        await self.release.wait()
+        self.documents.extend(documents)
+
+def test_messages_being_flushed_still_count_as_pending(monkeypatch):
+    history = SlowHistory()
+    monkeypatch.setattr(server, "db", types.SimpleNamespace(chat_history=history))
+    
+    async def run():
+        writer = server.ChatHistoryWriter(interval=60, max_pending=100)
+        writer._pending.append({"session_id": "s", "content": "hi"})
+        background = asyncio.create_task(writer.flush())
+        await asyncio.sleep(0)
+        assert not writer._pending
+        assert writer.has_pending("s")
+        assert not writer.has_pending("other")
+        
+        # A reader flushing now must wait for the write already in progress
+        reader = asyncio.create_task(writer.flush())
+        await asyncio.sleep(0)
+        assert not reader.done()
+        history.release.set()
+        await reader
+        assert [doc["content"] for doc in history.documents] == ["hi"]
+        assert not writer.has_pending("s")
+        await background
+    
+    asyncio.run(run())
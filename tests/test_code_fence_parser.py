@@ -0,0 +1,114 @@
+import asyncio
+import types
+
+import pytest
+
+import server
+
+def parse_streamed(reply: str, chunk_size: int):
+    """Blocks as the parser returns them when the reply arrives in chunks of chunk_size characters."""
+    parser = server.CodeFenceParser()
+    blocks = []
+    for start in range(0, len(reply), chunk_size):
+        blocks += parser.feed(reply[start:start + chunk_size])
+    return blocks + parser.finish()
+
+REPLY = """Here is the fix for **`src/utils.py`**:
+```python
+def f():
+    return 1
+```
+And a new file:
+```js app.js
+x()
+```
+```ts:lib/a.ts
+let a = 1
+```
+```
+# file: config.json
+{}
+```
+Note e.g. version 1.2 below
+```python
+print(1)
+```
+~~~~ title="b.css"
+a {}
+```
+~~~~
+"""
+
+def test_blocks_are_the_same_however_the_reply_is_chunked():
+    expected = server.extract_code_blocks(REPLY)
+    
+    assert len(expected) == 6
+    for chunk_size in (1, 3, 7, 64, len(REPLY)):
+        assert parse_streamed(REPLY, chunk_size) == expected
+
+def test_file_paths_come_from_info_string_comment_or_prose():
+    blocks = server.extract_code_blocks(REPLY)
+    
+    assert [(block["language"], block["file_path"]) for block in blocks] == [
+        ("python", "src/utils.py"),  # Prose line introducing the block
+        ("js", "app.js"),  # After the language tag
+        ("ts", "lib/a.ts"),  # language:path
+        ("json", "config.json"),  # First-line comment, language from the extension
+        ("python", None),  # "1.2" in the prose is not a path
+        ("css", "b.css"),  # title= attribute with no language tag
+    ]
+    assert blocks[0]["description"] == "Here is the fix for **`src/utils.py`**:"
+
+def test_shorter_or_different_fence_does_not_close_a_block():
+    block = server.extract_code_blocks(REPLY)[-1]
+    
+    assert block["code"] == "a {}\n```"
+    assert block["complete"]
+
+def test_block_cut_off_by_end_of_reply_is_incomplete():
+    parser = server.CodeFenceParser()
+    assert parser.feed("Truncated:\n```html\n<div>") == []
+    
+    [block] = parser.finish()
+    assert block["code"] == "<div>"
+    assert not block["complete"] and not block["can_apply"]
+
+@pytest.mark.parametrize("reply", ["no code here", "inline `code` only\n", "    ```indented four spaces\n"])
+def test_text_without_fences_has_no_blocks(reply):
+    assert server.extract_code_blocks(reply) == []
+
+def test_suggested_operations_edit_known_files_and_create_new_ones():
+    existing = server.ProjectFileRef("f1", "/src/utils.py")
+    operations = server.suggest_operations(server.extract_code_blocks(REPLY), {"src/utils.py": existing})
+    
+    assert [(op.operation, op.file_id, op.file_path, op.language) for op in operations] == [
+        ("edit", "f1", "/src/utils.py", "python"),
+        ("create", None, "/app.js", "javascript"),
+        ("create", None, "/lib/a.ts", "typescript"),
+        ("create", None, "/config.json", "json"),
+        ("create", None, "/b.css", "css"),
+    ]
+
+class PathOnlyFiles:
+    """A files collection that records the projections it is queried with."""
+    
+    def __init__(self):
+        self.projections = []
+    
+    def find(self, query, projection):
+        self.projections.append(projection)
+        return self.docs()
+    
+    async def docs(self):
+        yield {"_id": "f1", "path": "/src/utils.py"}
+
+def test_operations_without_project_context_read_only_paths(monkeypatch):
+    files = PathOnlyFiles()
+    monkeypatch.setattr(server, "db", types.SimpleNamespace(files=files))
+    monkeypatch.setattr(server, "project_indexes", server.ProjectIndexRegistry(max_projects=10, max_chars=1000))
+    
+    project_files = asyncio.run(server.project_files_by_path("project", use_index=False))
+    
+    assert files.projections == [{"path": 1}]
+    assert not server.project_indexes.loaded("project")
+    assert [(path, ref.id, ref.path) for path, ref in project_files.items()] == [("src/utils.py", "f1", "/src/utils.py")]
@@ -0,0 +1,112 @@
+import asyncio
+
+import server
+
+def response(text: str) -> server.CodeCompletionResponse:
+    return server.CodeCompletionResponse(completion=text, suggestions=[text])
+
+class Upstream:
+    """Completion calls that finish when released, counting how many were made."""
+    
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.calls = 0
+        self.cancelled = 0
+    
+    def factory(self, text: str):
+        async def fetch():
+            self.calls += 1
+            try:
+                await self.release.wait()
+            except asyncio.CancelledError:
+                self.cancelled += 1
+                raise
+            return response(text)
+        return fetch
+
+def test_identical_requests_share_one_call():
+    async def run():
+        coordinator = server.CompletionCoordinator(ttl=60)
+        upstream = Upstream()
+        tasks = [
+            asyncio.create_task(coordinator.run("key", client, upstream.factory("x")))
+            for client in ("a", "b")
+        ]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        results = await asyncio.gather(*tasks)
+        return coordinator, upstream, results
+    
+    coordinator, upstream, results = asyncio.run(run())
+    assert upstream.calls == 1
+    assert [result.completion for result in results] == ["x", "x"]
+    assert not coordinator._inflight and not coordinator._waiters and not coordinator._tickets
+
+def test_new_request_supersedes_and_cancels_the_clients_previous_one():
+    async def run():
+        coordinator = server.CompletionCoordinator(ttl=60)
+        upstream = Upstream()
+        first = asyncio.create_task(coordinator.run("old", "client", upstream.factory("old")))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(coordinator.run("new", "client", upstream.factory("new")))
+        assert await first is None
+        await asyncio.sleep(0)
+        upstream.release.set()
+        return upstream, await second
+    
+    upstream, result = asyncio.run(run())
+    assert result.completion == "new"
+    # Nobody else wanted the old completion, so its call was cancelled
+    assert upstream.calls == 2
+    assert upstream.cancelled == 1
+
+def test_superseded_call_keeps_running_for_other_waiters():
+    async def run():
+        coordinator = server.CompletionCoordinator(ttl=60)
+        upstream = Upstream()
+        mine = asyncio.create_task(coordinator.run("shared", "a", upstream.factory("shared")))
+        theirs = asyncio.create_task(coordinator.run("shared", "b", upstream.factory("shared")))
+        await asyncio.sleep(0)
+        newer = asyncio.create_task(coordinator.run("newer", "a", upstream.factory("newer")))
+        assert await mine is None
+        upstream.release.set()
+        return upstream, await theirs, await newer
+    
+    upstream, theirs, newer = asyncio.run(run())
+    assert upstream.cancelled == 0
+    assert (theirs.completion, newer.completion) == ("shared", "newer")
+
+def test_call_is_cancelled_when_its_last_waiter_goes_away():
+    async def run():
+        coordinator = server.CompletionCoordinator(ttl=60)
+        upstream = Upstream()
+        waiter = asyncio.create_task(coordinator.run("key", None, upstream.factory("x")))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        await asyncio.sleep(0)
+        return coordinator, upstream
+    
+    coordinator, upstream = asyncio.run(run())
+    assert upstream.cancelled == 1
+    assert not coordinator._inflight and not coordinator._waiters
+
+def test_typing_forward_through_a_suggestion_is_answered_from_cache():
+    coordinator = server.CompletionCoordinator(ttl=60)
+    coordinator.remember("file", "def f", "\nrest", ["(x):", "(y, z):"])
+    
+    cached = coordinator.lookup("file", "def f(y", "\nrest")
+    assert cached.cached
+    assert cached.completion == ", z):"
+    assert cached.suggestions == [", z):"]
+    # Typed past every suggestion, a different suffix, or a different prefix: no answer
+    assert coordinator.lookup("file", "def f(x):", "\nrest") is None
+    assert coordinator.lookup("file", "def f(", "\nother") is None
+    assert coordinator.lookup("file", "def g(", "\nrest") is None
+    assert coordinator.lookup("other", "def f(", "\nrest") is None
+
+def test_cached_suggestions_expire():
+    coordinator = server.CompletionCoordinator(ttl=-1)
+    coordinator.remember("file", "def f", "", ["(x):"])
+    
+    assert coordinator.lookup("file", "def f(", "") is None
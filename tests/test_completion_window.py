@@ -0,0 +1,58 @@
+import pytest
+
+import server
+
+@pytest.fixture(autouse=True)
+def small_window(monkeypatch):
+    monkeypatch.setattr(server, "COMPLETION_WINDOW_LINES_BEFORE", 3)
+    monkeypatch.setattr(server, "COMPLETION_WINDOW_LINES_AFTER", 2)
+    monkeypatch.setattr(server, "COMPLETION_WINDOW_MAX_TOKENS", 1000)
+
+def test_short_file_is_sent_whole_without_an_outline():
+    code = "x = 1\ny = 2\nz = "
+    
+    assert server.completion_window(code, len(code)) == ("", code, "")
+
+def test_window_keeps_configured_lines_around_the_cursor():
+    lines = [f"line{i}" for i in range(20)]
+    code = "\n".join(lines)
+    cursor = code.index("line10") + 4
+    
+    outline, before, after = server.completion_window(code, cursor)
+    assert before == "line7\nline8\nline9\nline"
+    assert after == "10\nline11\nline12"
+    assert outline == ""
+
+def test_outline_lists_imports_and_enclosing_headers_outside_the_window():
+    code = "\n".join([
+        "import os",
+        "from typing import List",
+        "",
+        "class Store:",
+        "    def unrelated(self):",
+        "        pass",
+        "",
+        "    def load(self, path):",
+        "        a = 1",
+        "        b = 2",
+        "        c = 3",
+        "        d = 4",
+        "        e = 5",
+        "        return ",
+    ])
+    
+    outline, before, after = server.completion_window(code, len(code))
+    assert outline == "import os\nfrom typing import List\n...\nclass Store:\n    def load(self, path):"
+    assert before == "        c = 3\n        d = 4\n        e = 5\n        return "
+    assert after == ""
+
+def test_token_budget_cuts_text_before_the_cursor_on_a_line_boundary(monkeypatch):
+    monkeypatch.setattr(server, "COMPLETION_WINDOW_MAX_TOKENS", 10)
+    code = "\n".join(["a" * 12, "b" * 12, "c" * 12, "d" * 4]) + "\n" + "e" * 50
+    cursor = code.index("d") + 4
+    
+    outline, before, after = server.completion_window(code, cursor)
+    # 40 characters in all, 30 of them before the cursor
+    assert before == "c" * 12 + "\n" + "d" * 4
+    assert after == "\n" + "e" * 22
+    assert len(before) + len(after) == 40
@@ -0,0 +1,39 @@
+import pytest
+
+import server
+
+@pytest.mark.parametrize("language, code", [
+    ("python", "print('update')"),
+    ("python", "def validate(x):\n    return x > 0\nprint(validate(1))"),
+    ("python", "import math, itertools\nprint(math.factorial(5), list(itertools.permutations('ab')))"),
+    ("python", "import sys\ninput = sys.stdin.readline\nprint(int(input()) * 2)"),
+    ("python", "from collections import Counter\nprint(Counter('hello').most_common(1))"),
+    ("javascript", "const validate = (x) => x > 0; console.log(validate(1), 'update')"),
+    ("javascript", "const assert = require('node:assert'); assert.ok(true); console.log([3, 1, 2].sort())"),
+    ("php", "<?php function validate($x) { return $x > 0; } echo validate(1), 'update';"),
+])
+def test_deterministic_code_is_cacheable(language, code):
+    assert server.is_cacheable_code(language, code)
+
+@pytest.mark.parametrize("language, code", [
+    ("python", "import glob\nprint(glob.glob('*'))"),
+    ("python", "from pathlib import Path\nprint(Path('main.py').read_text())"),
+    ("python", "import os\nprint(list(os.walk('.')))"),
+    ("python", "import subprocess\nprint(subprocess.check_output(['ls']))"),
+    ("python", "import random as r\nprint(r.random())"),
+    ("python", "import sys\nprint(sys.argv)"),
+    ("python", "print(open('x').read())"),
+    ("python", "print({'a', 'b', 'c'})"),
+    ("python", "print(id(1))"),
+    ("python", "print(("),
+    ("javascript", "const {readFileSync} = require(\"fs\"); console.log(readFileSync('x'))"),
+    ("javascript", "console.log(Math.random())"),
+    ("javascript", "console.log(new Date())"),
+    ("javascript", "const name = 'fs'; console.log(require(name))"),
+    ("typescript", "console.log(process.env.HOME)"),
+    ("php", "<?php $a = [1, 2, 3]; shuffle($a); print_r($a);"),
+    ("php", "<?php echo DATE('Y');"),
+    ("php", "<?php echo `ls`;"),
+])
+def test_nondeterministic_code_is_not_cacheable(language, code):
+    assert not server.is_cacheable_code(language, code)
@@ -0,0 +1,161 @@
+import asyncio
+import json
+import shutil
+
+import pytest
+
+import server
+
+# Programs that exercise Node's globals, process and event loop. Each must behave
+# the same on a pool worker as under a plain `node main.js`.
+NODE_PARITY_PROGRAMS = [
+    "setImmediate(() => console.log('immediate')); console.log('sync')",
+    "process.nextTick(() => console.log('tick')); console.log('sync')",
+    "queueMicrotask(() => console.log('micro')); console.log(structuredClone({a: [1]}).a[0])",
+    "console.log(typeof performance, typeof fetch, typeof structuredClone, typeof AbortController)",
+    "console.log(performance.now() > 0, typeof crypto.randomUUID())",
+    "console.log(process.platform === require('os').platform(), process.version === `v${process.versions.node}`)",
+    "console.log(typeof fs, typeof http, typeof __dirname, typeof module, typeof exports)",
+    "setTimeout(() => setImmediate(() => console.log('nested')), 5)",
+    "const i = setImmediate(() => console.log('never')); clearImmediate(i); console.log('cleared')",
+    "require('fs').stat('.', () => setTimeout(() => console.log('after io'), 5))",
+    "async function main() { await new Promise((r) => setTimeout(r, 5)); console.log('awaited'); } main()",
+    "process.exitCode = 3; console.log('exit code')",
+    "process.stdout.write('out\\n'); process.stderr.write('err\\n'); process.exit(2)",
+    "Promise.reject(new Error('rejected'))",
+    "throw new TypeError('thrown')",
+    "console.dir({a: {b: 1}}); console.group('g'); console.log('in'); console.groupEnd(); console.count(); console.count()",
+    "console.table([{a: 1}]); console.assert(false, 'nope'); console.time('t'); console.log(typeof console.timeEnd)",
+    "try { require('fs').readFileSync('/missing') } catch (e) { console.log(e instanceof Error, e.code) }",
+    "console.log(Buffer.from('hi') instanceof Uint8Array, [] instanceof Array, new Map() instanceof Map)",
+    "console.log(typeof process.env.PATH, Object.keys(process.env).length > 0)",
+    "process.on('exit', (code) => console.log('exiting', code)); process.exitCode = 5",
+    "require('util').promisify(setTimeout)(5).then(() => console.log('promisified'))",
+    "var top = 1; console.log(globalThis.top, this === module.exports, require.main === module)",
+]
+
+# Programs that exercise how the interpreter runs and finishes a script. Each must
+# behave the same on a pool worker as under a plain `python main.py`.
+PYTHON_PARITY_PROGRAMS = [
+    "import threading, time\nthreading.Thread(target=lambda: (time.sleep(0.05), print('thread'))).start()\nprint('main')",
+    "import atexit\natexit.register(print, 'at exit')\nprint('main')",
+    "import pickle\nclass A:\n    pass\nprint(type(pickle.loads(pickle.dumps(A()))).__name__)",
+    "import inspect\ndef f():\n    return 1\nprint(inspect.getsource(f), end='')",
+    "import multiprocessing\ndef square(x):\n    return x * x\nwith multiprocessing.Pool(2) as p:\n    print(p.map(square, [1, 2, 3]))",
+    "import sys\nprint(__name__, sys.argv[0].endswith('.py'), sys.modules['__main__'].__name__)",
+    "import sys\nprint('out')\nsys.exit(3)",
+    "raise ValueError('boom')",
+]
+
+@pytest.fixture(scope="module")
+def pools():
+    loop = asyncio.new_event_loop()
+    pools = {}
+    for runtime in ("python", "node"):
+        if shutil.which(server.WORKER_BOOTSTRAPS[runtime][0]):
+            pools[runtime] = server.WorkerPool(runtime, 1, 100, 300)
+            loop.run_until_complete(pools[runtime].start())
+    yield loop, pools
+    for pool in pools.values():
+        loop.run_until_complete(pool.close())
+    # Let the killed workers be reaped before the loop goes away
+    loop.run_until_complete(asyncio.sleep(0.2))
+    loop.close()
+
+def run_both(pools, language, code, stdin=""):
+    loop, pools = pools
+    runtime, interpreter, suffix = server.EXECUTION_LANGUAGES[language]
+    if runtime not in pools:
+        pytest.skip(f"{interpreter} is not installed")
+    pooled = loop.run_until_complete(pools[runtime].execute(code, stdin, server.EXECUTION_TIMEOUT))
+    one_shot = loop.run_until_complete(server.run_one_shot(interpreter, suffix, code, stdin, server.EXECUTION_TIMEOUT))
+    return pooled, one_shot
+
+@pytest.mark.parametrize("code", NODE_PARITY_PROGRAMS)
+def test_node_pool_matches_one_shot(pools, code):
+    pooled, one_shot = run_both(pools, "javascript", code)
+    
+    assert pooled["stdout"] == one_shot["stdout"]
+    assert pooled["returncode"] == one_shot["returncode"]
+    assert bool(pooled["stderr"]) == bool(one_shot["stderr"])
+
+@pytest.mark.parametrize("code", PYTHON_PARITY_PROGRAMS)
+def test_python_pool_matches_one_shot(pools, code):
+    pooled, one_shot = run_both(pools, "python", code)
+    
+    assert pooled["stdout"] == one_shot["stdout"]
+    assert pooled["returncode"] == one_shot["returncode"]
+    assert bool(pooled["stderr"]) == bool(one_shot["stderr"])
+
+@pytest.mark.parametrize("language, code", [
+    ("python", "print(input().upper())"),
+    ("javascript", "process.stdin.on('data', (d) => process.stdout.write(String(d).toUpperCase()))"),
+])
+def test_pool_passes_stdin(pools, language, code):
+    pooled, one_shot = run_both(pools, language, code, "hi\n")
+    
+    assert pooled["stdout"] == one_shot["stdout"] == "HI\n"
+
+def test_python_pool_tracebacks_show_source_lines(pools):
+    pooled, _ = run_both(pools, "python", "x = 1\nraise ValueError('boom')")
+    
+    assert 'File "main.py", line 2, in <module>\n    raise ValueError(\'boom\')' in pooled["stderr"]
+
+def test_node_pool_jobs_do_not_share_state(pools):
+    loop, node_pools = pools
+    if "node" not in node_pools:
+        pytest.skip("node is not installed")
+    pool = node_pools["node"]
+    loop.run_until_complete(pool.execute("globalThis.leak = 1; process.exitCode = 4; setInterval(() => {}, 1000); process.exit(0)", "", 5))
+    result = loop.run_until_complete(pool.execute("console.log(typeof leak, process.exitCode)", "", 5))
+    
+    assert result == {"stdout": "undefined undefined\n", "stderr": "", "returncode": 0}
+
+def test_stream_timeout_excludes_queue_wait(monkeypatch):
+    monkeypatch.setattr(server, "EXECUTION_TIMEOUT", 3)
+    monkeypatch.setattr(server, "execution_limiter", server.ExecutionLimiter(1, 4))
+    
+    async def run():
+        events = [event async for event in server.stream_one_shot(
+            "python", "python3", ".py", "import time; time.sleep(2); print('done')", None
+        )]
+        return json.loads(events[-1].split("data: ", 1)[1])
+    
+    async def run_two():
+        return await asyncio.gather(run(), run())
+    
+    # The second run waits ~2s for the only slot, then still gets its full 3s
+    for exit_event in asyncio.run(run_two()):
+        assert exit_event["returncode"] == 0
+        assert not exit_event["timed_out"]
+
+def stream_events(code):
+    async def run():
+        return [event async for event in server.stream_one_shot("python", "python3", ".py", code, None)]
+    
+    events = []
+    for event in asyncio.run(run()):
+        name, data = event.split("\n", 1)
+        events.append((name.split(": ", 1)[1], json.loads(data.split("data: ", 1)[1])))
+    return events
+
+def test_stream_output_cap_counts_bytes(monkeypatch):
+    monkeypatch.setattr(server, "EXECUTION_STREAM_MAX_BYTES", 9)
+    
+    events = stream_events("print('é' * 20)")
+    output = "".join(data["data"] for name, data in events if name == "stdout")
+    # Two bytes each, so four whole characters fit
+    assert output == "éééé"
+    assert events[-1][1]["truncated"]
+
+def test_stream_reports_full_queue_as_an_error_event(monkeypatch):
+    limiter = server.ExecutionLimiter(1, 0)
+    monkeypatch.setattr(server, "execution_limiter", limiter)
+    
+    async def run():
+        async with limiter.slot():
+            return [event async for event in server.stream_one_shot("python", "python3", ".py", "print(1)", None)]
+    
+    events = asyncio.run(run())
+    assert len(events) == 1
+    assert events[0].startswith("event: error\n")
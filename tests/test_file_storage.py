@@ -0,0 +1,50 @@
+import random
+
+import pytest
+
+import server
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(server, "FILE_CHUNK_CHARS", 1024)
+    monkeypatch.setattr(server, "FILE_CHUNK_MIN_CHARS", 256)
+    monkeypatch.setattr(server, "FILE_CHUNK_MAX_CHARS", 4096)
+
+def source_lines(count: int) -> str:
+    rng = random.Random(count)
+    return "".join(f"    value_{i} = compute({rng.randint(0, 10 ** 6)})  # step {i}\n" for i in range(count))
+
+def test_split_chunks_round_trips_within_bounds(small_chunks):
+    content = source_lines(3000)
+    chunks = server.split_chunks(content)
+    
+    assert "".join(chunks) == content
+    assert all(len(chunk) <= server.FILE_CHUNK_MAX_CHARS for chunk in chunks)
+    assert all(len(chunk) >= server.FILE_CHUNK_MIN_CHARS for chunk in chunks[:-1])
+
+@pytest.mark.parametrize("edit", [
+    lambda text: "x" + text,
+    lambda text: text[1:],
+    lambda text: text[:len(text) // 2] + "inserted = True\n" + text[len(text) // 2:],
+])
+def test_split_chunks_edit_changes_one_chunk(small_chunks, edit):
+    content = source_lines(3000)
+    before = set(server.split_chunks(content))
+    after = server.split_chunks(edit(content))
+    
+    assert len([chunk for chunk in after if chunk not in before]) == 1
+
+def test_split_chunks_cuts_long_lines_at_delimiters(small_chunks):
+    minified = ";".join(f"var a{i}=function(){{return {i}}}" for i in range(2000))
+    before = set(server.split_chunks(minified))
+    after = server.split_chunks("x" + minified)
+    
+    assert "".join(after) == "x" + minified
+    assert len([chunk for chunk in after if chunk not in before]) == 1
+
+def test_split_chunks_without_delimiters_falls_back_to_max_size(small_chunks):
+    blob = "a" * 10000
+    chunks = server.split_chunks(blob)
+    
+    assert "".join(chunks) == blob
+    assert [len(chunk) for chunk in chunks] == [4096, 4096, 1808]
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+import server
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+async def hold(limiter, events, name, release):
+    async with limiter.slot("local", "model"):
+        events.append(name)
+        await release.wait()
+
+def test_freed_slots_go_to_waiters_first_come_first_served():
+    async def run():
+        limiter = server.LlmLimiter(concurrency=1, max_queue=4, max_wait=5)
+        events = []
+        release = asyncio.Event()
+        tasks = []
+        for name in "abc":
+            tasks.append(asyncio.create_task(hold(limiter, events, name, release)))
+            await asyncio.sleep(0)
+        assert events == ["a"]
+        assert limiter.stats() == {"local/model": {"running": 1, "waiting": 2}}
+        
+        release.set()
+        await asyncio.gather(*tasks)
+        return limiter, events
+    
+    limiter, events = asyncio.run(run())
+    assert events == ["a", "b", "c"]
+    assert limiter.stats() == {}
+
+def test_full_queue_is_rejected_at_once():
+    async def run():
+        limiter = server.LlmLimiter(concurrency=1, max_queue=1, max_wait=5)
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(hold(limiter, [], name, release)) for name in "ab"]
+        await asyncio.sleep(0)
+        assert limiter.full("local", "model")
+        with pytest.raises(server.LlmBusy):
+            async with limiter.slot("local", "model"):
+                pass
+        release.set()
+        await asyncio.gather(*tasks)
+    
+    asyncio.run(run())
+
+def test_waiting_past_max_wait_raises_busy_and_leaves_the_queue():
+    async def run():
+        limiter = server.LlmLimiter(concurrency=1, max_queue=4, max_wait=0.05)
+        release = asyncio.Event()
+        holder = asyncio.create_task(hold(limiter, [], "a", release))
+        await asyncio.sleep(0)
+        with pytest.raises(server.LlmBusy):
+            async with limiter.slot("local", "model"):
+                pass
+        assert limiter.stats() == {"local/model": {"running": 1, "waiting": 0}}
+        release.set()
+        await holder
+        return limiter
+    
+    assert asyncio.run(run()).stats() == {}
+
+def test_slot_handed_to_a_cancelled_waiter_is_passed_on():
+    async def run():
+        limiter = server.LlmLimiter(concurrency=1, max_queue=4, max_wait=5)
+        events = []
+        held = limiter.slot("local", "model")
+        await held.__aenter__()
+        waiter = asyncio.create_task(hold(limiter, events, "b", asyncio.Event()))
+        await asyncio.sleep(0)
+        late = asyncio.create_task(hold(limiter, events, "c", asyncio.Event()))
+        await asyncio.sleep(0)
+        
+        # Hand the slot to "b" and cancel it before it gets to run
+        await held.__aexit__(None, None, None)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await settle()
+        # "b" passed the slot on to "c" instead of leaking it
+        assert events == ["c"]
+        assert limiter.stats() == {"local/model": {"running": 1, "waiting": 0}}
+        late.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await late
+        return limiter
+    
+    assert asyncio.run(run()).stats() == {}
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def run():
+        limiter = server.LlmLimiter(concurrency=1, max_queue=4, max_wait=5)
+        held = limiter.slot("local", "model")
+        await held.__aenter__()
+        waiter = asyncio.create_task(hold(limiter, [], "b", asyncio.Event()))
+        await settle()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert limiter.stats() == {"local/model": {"running": 1, "waiting": 0}}
+        await held.__aexit__(None, None, None)
+        return limiter
+    
+    assert asyncio.run(run()).stats() == {}
@@ -0,0 +1,81 @@
+import asyncio
+import types
+
+import server
+
+def file_doc(file_id: str, content: str, version: int = 1) -> dict:
+    return {
+        "_id": file_id,
+        "project_id": "project",
+        "name": f"{file_id}.py",
+        "path": f"/src/{file_id}.py",
+        "language": "python",
+        "content": content,
+        "version": version,
+    }
+
+def test_indexed_file_keeps_chunks_imports_and_head_but_not_content():
+    content = "import helpers\n" + "value = compute()\n" * 2000
+    entry = server.IndexedFile(file_doc("main", content))
+    
+    assert not hasattr(entry, "content")
+    assert entry.imports == {"helpers"}
+    assert entry.head == content[:server.PROJECT_INDEX_HEAD_CHARS]
+    assert entry.length == len(content)
+    assert entry.chars == len(entry.head) + sum(len(chunk.text) for chunk in entry.chunks)
+
+def test_project_index_tracks_chars_through_updates():
+    index = server.ProjectIndex()
+    index.upsert(file_doc("a", "x = 1\n" * 100))
+    index.upsert(file_doc("b", "y = 2\n"))
+    assert index.chars == sum(entry.chars for entry in index.files.values())
+    
+    index.upsert(file_doc("a", "x = 1\n", version=2))
+    index.remove("b")
+    assert index.chars == index.files["a"].chars
+
+def test_registry_evicts_least_recently_used_past_char_bound():
+    registry = server.ProjectIndexRegistry(max_projects=10, max_chars=1000)
+    for project_id in ["old", "new"]:
+        registry._indexes[project_id] = server.ProjectIndex()
+    
+    registry.file_saved({**file_doc("a", "z = 3\n" * 50), "project_id": "old"})
+    registry.file_saved({**file_doc("b", "w = 4\n" * 100), "project_id": "new"})
+    
+    assert list(registry._indexes) == ["new"]
+    assert registry.chars > registry.max_chars  # The index in use is kept even when over the bound
+
+class SlowFiles:
+    """A files collection whose reads wait until released."""
+    
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.reads = 0
+    
+    def find(self, *args):
+        self.reads += 1
+        return self.docs()
+    
+    async def docs(self):
+        await self.release.wait()
+        yield file_doc("a", "x = 1\n")
+
+def test_waiters_build_the_index_themselves_when_the_loader_is_cancelled(monkeypatch):
+    files = SlowFiles()
+    monkeypatch.setattr(server, "db", types.SimpleNamespace(files=files))
+    
+    async def run():
+        registry = server.ProjectIndexRegistry(max_projects=10, max_chars=1000)
+        loader = asyncio.create_task(registry.get("project"))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(registry.get("project"))
+        await asyncio.sleep(0)
+        loader.cancel()
+        await asyncio.sleep(0)
+        files.release.set()
+        return loader, await waiter
+    
+    loader, index = asyncio.run(run())
+    assert loader.cancelled()
+    assert list(index.files) == ["a"]
+    assert files.reads == 2
@@ -0,0 +1,35 @@
+import pytest
+from fastapi import HTTPException
+
+import server
+
+def edit(start: int, end: int, text: str) -> server.TextEdit:
+    return server.TextEdit(start=start, end=end, text=text)
+
+def test_edits_apply_in_offset_order():
+    content = "hello world"
+    edits = [edit(6, 11, "there"), edit(0, 5, "HELLO"), edit(5, 5, ",")]
+    
+    assert server.apply_text_edits(content, edits) == "HELLO, there"
+
+def test_offsets_count_utf16_code_units():
+    # Each emoji is one Python character but two UTF-16 code units
+    content = "a😀b😀c"
+    
+    assert server.apply_text_edits(content, [edit(3, 4, "B")]) == "a😀B😀c"
+    assert server.apply_text_edits(content, [edit(0, 1, "A"), edit(3, 3, "_"), edit(6, 7, "C")]) == "A😀_b😀C"
+
+def test_offsets_without_non_bmp_characters_are_string_indices():
+    assert server.apply_text_edits("héllo", [edit(1, 2, "e")]) == "hello"
+
+@pytest.mark.parametrize("edits", [
+    [edit(2, 2, "x")],  # Inside the emoji's surrogate pair
+    [edit(0, 8, "")],  # Past the end: the content is 7 code units long
+    [edit(-1, 0, "")],
+    [edit(3, 1, "")],
+    [edit(0, 4, ""), edit(3, 5, "")],  # Overlapping
+])
+def test_invalid_edits_are_rejected(edits):
+    with pytest.raises(HTTPException) as error:
+        server.apply_text_edits("a😀b😀c", edits)
+    assert error.value.status_code == 400